@@ -2,6 +2,7 @@
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
 from .emmorphpy import EmMorphPy
+from .asyncemmorphpy import AsyncEmMorphPy
 from .version import __version__
 
-__all__ = ['EmMorphPy', __version__]
+__all__ = ['EmMorphPy', 'AsyncEmMorphPy', __version__]
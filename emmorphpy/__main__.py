@@ -2,6 +2,10 @@
 # -*- coding: utf-8, vim: expandtab:ts=4 -*-
 
 import sys
+from itertools import islice
+from collections import deque
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
 
 from . import EmMorphPy
 
@@ -19,35 +23,112 @@ def input_wrapper():  # TODO: Include in xtsv?
             return
 
 
-def raw_dstem_helper(fh):
-    emmorph = EmMorphPy()
-    for line in fh:
-        line = line.strip()
-        for i in emmorph.dstem(line, out_mode=list):
-            if len(i) == 5:
-                print(line, i[2], i[0], i[1], sep='\t')
+RAW_FIELDS = ('lemma', 'tag', 'morphana')  # Only these fields of dstem are computed
+
+
+def raw_dstem_format(batch, outputs):
+    """
+    The output of a batch as one string (written at once)
+    """
+    out = []
+    for line, anals in zip(batch, outputs):
+        for i in anals:
+            if len(i) == 3:
+                out.append('{0}\t{1}\t{2}\t{3}\n'.format(line, i[2], i[0], i[1]))
             else:
-                print(line, '<unknown>', sep='\t')
-        print()
+                out.append('{0}\t<unknown>\n'.format(line))
+        out.append('\n')
+    return ''.join(out)
 
 
-def raw_input_processor(inp_stream):
-    if inp_stream == sys.stdin:
+def raw_dstem_helper(fh, max_count=None, batch_size=1, backend='hfst-lookup', disk_cache=None, out=sys.stdout):
+    emmorph = EmMorphPy(max_count=max_count, backend=backend, disk_cache=disk_cache)
+    lines = (line.strip() for line in fh)
+    while True:
+        batch = list(islice(lines, batch_size))  # Batches are pipelined and spread over the hfst-lookup processes
+        if len(batch) == 0:
+            break
+        out.write(raw_dstem_format(batch, emmorph.dstem_many(batch, out_mode=list, fields=RAW_FIELDS)))
+    emmorph.close()
+
+
+_worker_emmorph = None  # The analyzer of the worker process in parallel mode
+_worker_error = None
+
+
+def _init_worker(max_count, backend, disk_cache):
+    global _worker_emmorph, _worker_error
+    try:
+        _worker_emmorph = EmMorphPy(max_count=max_count, backend=backend, disk_cache=disk_cache)
+    except BaseException as e:  # Pool would restart the failing workers forever: it is raised with the first chunk
+        _worker_error = e
+        return
+    Finalize(_worker_emmorph, _worker_emmorph.close, exitpriority=10)  # At the exit of the worker (eg. flush the cache)
+
+
+def _raw_dstem_chunk(batch):
+    try:
+        if _worker_error is not None:
+            raise _worker_error
+        return raw_dstem_format(batch, _worker_emmorph.dstem_many(batch, out_mode=list, fields=RAW_FIELDS))
+    except SystemExit as e:  # It would kill the worker and the chunk would never be done
+        raise RuntimeError('The analyzer exited with {0}'.format(e.code))
+
+
+def raw_dstem_parallel(fh, jobs, max_count=None, batch_size=10000, backend='hfst-lookup', disk_cache=None,
+                       out=sys.stdout):
+    """
+    The chunks of batch_size lines are analysed and formatted by jobs worker processes (each with its own analyzer
+     and max_count hfst-lookup processes, default: 1) and written in the order of the input.
+    At most 2 * jobs chunks are in flight, so the memory usage does not depend on the size of the input
+    """
+    if max_count is None:
+        max_count = 1
+    lines = (line.strip() for line in fh)
+    with Pool(jobs, _init_worker, (max_count, backend, disk_cache)) as pool:
+        in_flight = deque()
+        while True:
+            batch = list(islice(lines, batch_size))
+            if len(batch) > 0:
+                in_flight.append(pool.apply_async(_raw_dstem_chunk, (batch,)))
+            elif len(in_flight) == 0:
+                break
+            if len(in_flight) >= 2 * jobs or len(batch) == 0:
+                out.write(in_flight.popleft().get())
+        pool.close()  # The workers exit normally (and close their analyzers) instead of being terminated
+        pool.join()
+
+
+def raw_input_processor(inp_stream, max_count=None, backend='hfst-lookup', disk_cache=None, jobs=None):
+    if jobs is not None:  # Streaming mode (also for STDIN)
+        raw_dstem_parallel(inp_stream, jobs, max_count, backend=backend, disk_cache=disk_cache)
+    elif inp_stream == sys.stdin:
         print('Type one word per line, Ctrl+D or empty word to exit')
-        raw_dstem_helper(input_wrapper())
+        raw_dstem_helper(input_wrapper(), max_count, backend=backend, disk_cache=disk_cache)
     else:
-        raw_dstem_helper(inp_stream)
+        raw_dstem_helper(inp_stream, max_count, batch_size=10000, backend=backend, disk_cache=disk_cache)
 
 
 def main():
     argparser = parser_skeleton(description='emMorphPy - A wrapper, a lemmatizer and REST API implemented in Python for'
                                             ' emMorph (Humor) Hungarian morphological analyzer')
     add_bool_arg(argparser, 'raw', 'Process tokens raw one token per line (without xtsv) incl. interactive mode')
+    argparser.add_argument('--max-count', dest='max_count', type=int, default=None,
+                           help='Maximal number of hfst-lookup processes (default: analyzer.max_count in the props file)',
+                           metavar='N')
+    argparser.add_argument('--backend', dest='backend', choices=('hfst-lookup', 'python'), default='hfst-lookup',
+                           help='Use hfst-lookup processes or the in-process lookup (needs NumPy) for the analysis')
+    argparser.add_argument('--disk-cache', dest='disk_cache', default=None,
+                           help='Persistent cache of the analyses (SQLite database, created if not exists)',
+                           metavar='FILE')
+    argparser.add_argument('--jobs', dest='jobs', type=int, default=None,
+                           help='Process the raw input in N worker processes (streaming mode, the output is in the'
+                                ' order of the input)', metavar='N')
 
     opts = argparser.parse_args()
 
     if opts.raw:
-        raw_input_processor(opts.input_stream)
+        raw_input_processor(opts.input_stream, opts.max_count, opts.backend, opts.disk_cache, opts.jobs)
         exit()
 
     # Set input and output iterators...
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import sys
+import asyncio
+import functools
+
+from .emmorphpy import EmMorphPy, ERROR_TAG
+from .hfstlookup import AsyncHfstLookup, HfstLookupError, check_words
+
+
+class AsyncEmMorphPy(EmMorphPy):
+    """
+    EmMorphPy for asyncio: stem, analyze, dstem (and their batch versions), process_token and process_sentence
+     are coroutines, which never block the event loop on hfst-lookup
+    The config, the caches, the stemmer and the output formats are the same as in EmMorphPy, but all queries share
+     one hfst-lookup process (started at the first query) through AsyncHfstLookup, so any number of concurrent
+     callers need no extra processes
+    The in-process (python) backend is also supported, but its lookup runs in the event loop (it has no I/O to wait for)
+    The warm-up is a task of the event loop (started by the first query or warm_up_done()), which queries through the
+     same AsyncHfstLookup as the callers
+    """
+    test_at_init = False
+    _warm_up_hooks = ('_spec_query_async', '_spec_query_many_async')
+    _warm_up_source = None
+    _warm_up_task = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self._pool is not None:  # The hfst-lookup backend
+            self._lookup = AsyncHfstLookup(self._pool.cmd, self._max_allowed_anals, self._timeout, self.max_retries,
+                                           self._truncation)
+            self._backend_query_many_async = self._hfst_query_many_async
+        else:
+            self._lookup = None
+            self._backend_query_many_async = self._hfstol_query_many_async
+        if self.metrics is not None:
+            self.metrics.wrap_async(self, '_query_many_async')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _restarts(self):
+        return self._lookup.restarts if self._lookup is not None else 0
+
+    def _crashes(self):
+        return self._lookup.crashes if self._lookup is not None else 0
+
+    async def close(self):
+        if self._warm_up_task is not None:  # The running batch is finished before the process is closed
+            self._warm_up_stopped = True
+            await self._warm_up_task
+        if self._lookup is not None:
+            await self._lookup.close()
+        super().close()
+
+    def _start_warm_up(self, source, n):
+        """
+        No thread (and no processes of the HfstLookupPool): the task is started in the event loop of the first query
+        """
+        self._warm_up_source = (source, n)
+        self._warm_up_stopped = False
+        for name in self._warm_up_hooks:
+            setattr(self, name, self._warm_up_hook(getattr(self, name)))
+
+    def _warm_up_hook(self, fun):
+        @functools.wraps(fun)
+        def hooked(*args, **kwargs):
+            self._start_warm_up_task()
+            return fun(*args, **kwargs)
+        return hooked
+
+    def _start_warm_up_task(self):
+        if self._warm_up_task is None:
+            self._warm_up_task = asyncio.ensure_future(self._warm_up_async(*self._warm_up_source))
+            for name in self._warm_up_hooks:
+                self.__dict__.pop(name, None)  # The task stores its results in the cache itself
+
+    async def _warm_up_async(self, source, n):
+        try:
+            for snapshot, batch in self._warm_up_batches(source, n):
+                if not snapshot:
+                    exceptions = [frozenset(self.exceptions.get(inp, ())) for inp in batch]
+                    batch = list(zip(batch, exceptions, await self._query_many_async(batch)))
+                self._store_warm_up_batch(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print('WARNING: Warm-up from {0} failed: {1}'.format(source, e), file=sys.stderr)
+
+    async def warm_up_done(self, timeout=None):
+        """
+        Wait for the warm-up (at most timeout seconds) and return True if it is finished (its results are in the cache)
+        """
+        if self._warm_up_source is None:
+            return True
+        self._start_warm_up_task()
+        await asyncio.wait([self._warm_up_task], timeout=timeout)
+        return self._warm_up_task.done()
+
+    async def process_sentence(self, sen, field_names):
+        # The JSON outputs are cached, the other words of the sentence are queried in one pipelined batch
+        inps = [tok[field_names[0]] for tok in sen]
+        outputs, todo = self._json_cache_get_many(inps)
+        if len(todo) > 0:
+            outputs = self._json_cache_put_many(inps, outputs, todo, await self._spec_query_many_async(todo))
+        for tok, output_json in zip(sen, outputs):
+            tok.append(output_json)
+        return sen
+
+    async def process_token(self, token):
+        return self._format_token(await self._spec_query_async(token))
+
+    async def stem(self, inp, out_mode=lambda x: sorted(set(x))):
+        return self._stem_out(await self._spec_query_async(inp), out_mode)
+
+    async def first_stems(self, inp, n=1, out_mode=lambda x: sorted(set(x))):
+        """
+        The same result as EmMorphPy.first_stems(), but the word is analysed fully (and cached): the analyses of the
+         shared process can not be stopped for one word
+        """
+        return self._stem_out(self._first_lemmas(await self._spec_query_async(inp), n), out_mode)
+
+    async def analyze(self, inp, out_mode=lambda x: sorted(set(x))):
+        return self._analyze_out(await self._spec_query_async(inp), out_mode)
+
+    async def dstem(self, inp, out_mode=lambda x: sorted(set(x)), fields=None):
+        return self._dstem_out(await self._spec_query_async(inp), out_mode, fields)
+
+    async def stem_many(self, inps, out_mode=lambda x: sorted(set(x))):
+        return [self._stem_out(anals, out_mode) for anals in await self._spec_query_many_async(inps)]
+
+    async def analyze_many(self, inps, out_mode=lambda x: sorted(set(x))):
+        return [self._analyze_out(anals, out_mode) for anals in await self._spec_query_many_async(inps)]
+
+    async def dstem_many(self, inps, out_mode=lambda x: sorted(set(x)), fields=None):
+        return [self._dstem_out(anals, out_mode, fields) for anals in await self._spec_query_many_async(inps)]
+
+    async def _spec_query_async(self, inp):
+        output = self.cache.get(inp)
+        if output is not None:
+            return output
+
+        check_words((inp,))
+        return self._cache_store(inp, (await self._query_many_async([inp]))[0])
+
+    async def _spec_query_many_async(self, inps):
+        """
+        Async version of _spec_query_many()
+        """
+        cache_get = self.cache.get
+        results = {}
+        todo = []
+        for inp in inps:
+            if inp not in results:
+                output = cache_get(inp)
+                if output is None:
+                    todo.append(inp)
+                results[inp] = output
+
+        if len(todo) > 0:
+            check_words(todo)
+            for inp, output in zip(todo, await self._query_many_async(todo)):
+                results[inp] = self._cache_store(inp, output)
+
+        return [results[inp] for inp in inps]
+
+    async def _query_many_async(self, inps):
+        if self._fullform is None:
+            return await self._shared_cache_query_many_async(inps)
+
+        outputs, todo = self._fullform_get_many(inps)
+        if len(todo) > 0:
+            outputs.update(zip(todo, await self._shared_cache_query_many_async(todo)))
+        return [outputs[inp] for inp in inps]
+
+    async def _shared_cache_query_many_async(self, inps):
+        if self._shared_cache is None:
+            return await self._disk_cache_query_many_async(inps)
+
+        outputs, todo = self._shared_cache_get_many(inps)
+        if len(todo) > 0:
+            self._shared_cache_put_many(outputs, todo, await self._disk_cache_query_many_async(todo))
+        return [outputs[inp] for inp in inps]
+
+    async def _disk_cache_query_many_async(self, inps):
+        if self._disk_cache is None:
+            return await self._backend_query_many_async(inps)
+
+        outputs, todo = self._disk_cache_get_many(inps)
+        if len(todo) > 0:
+            self._disk_cache_put_many(outputs, todo, await self._backend_query_many_async(todo))
+        return [outputs[inp] for inp in inps]
+
+    async def _hfst_query_many_async(self, inps):
+        outputs = []
+        for inp, result in zip(inps, await self._lookup.query_many(inps)):
+            if isinstance(result, HfstLookupError):
+                with self._stats_lock:
+                    self.no_of_errors += 1
+                outputs.append([(inp, ERROR_TAG, '', '')])
+                continue
+            anals, timed_out = result
+            if timed_out:  # Even if the kept anals are truncated before the timeout (as in _hfst_anals())
+                with self._stats_lock:
+                    self.no_of_timeouts += 1
+            outputs.append(self._process_anals(inp, self._async_anals(anals, timed_out)))
+        return outputs
+
+    async def _hfstol_query_many_async(self, inps):
+        return self._hfstol_query_many(inps)
+
+    @staticmethod
+    def _async_anals(anals, timed_out):
+        """
+        Generator of the analyses read by AsyncHfstLookup in the format of _hfst_anals() (None marks the timeout)
+        """
+        yield from anals
+        if timed_out:
+            yield None
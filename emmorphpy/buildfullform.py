@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Build the full-form index (see FullFormIndex) of the analyses of a frequency-ranked word list:
+ python3 -m emmorphpy.buildfullform -i freq_list.txt -o hu.fullform --max-words 300000
+"""
+
+import sys
+import argparse
+from itertools import islice
+
+from .emmorphpy import EmMorphPy, TRANSIENT_TAGS
+from .fullform import write_index
+from .warmup import read_word_list
+
+
+def build_index(emmorph, words, filename, batch_size=10000):
+    """
+    Analyse the words with the backend of emmorph and write the index of their analyses
+    The exceptions are turned off (the index is not used for the words with exceptions), the extra anals
+     of the lexicon are added at query time and the timed out words are left out
+    Returns the number of indexed words
+    """
+    emmorph.exceptions = {}
+    outputs = {}
+    words = iter(words)
+    while True:
+        batch = list(islice(words, batch_size))
+        if len(batch) == 0:
+            break
+        for word, output in zip(batch, emmorph._query_many(batch)):
+            if len(output) == 0 or output[-1][1] not in TRANSIENT_TAGS:
+                outputs[word] = output
+    write_index(filename, emmorph._fingerprint(), outputs)
+    return len(outputs)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='Build the full-form index of the analyses of the most frequent'
+                                                    ' words for EmMorphPy(fullform_index=FILE)')
+    argparser.add_argument('-i', '--input', required=True,
+                           help='Frequency-ranked word list (one word per line, the fields after a tab are ignored)',
+                           metavar='FILE')
+    argparser.add_argument('-o', '--output', required=True, help='The index file', metavar='FILE')
+    argparser.add_argument('--max-words', dest='max_words', type=int, default=None,
+                           help='Index only the first N different words (default: all)', metavar='N')
+    argparser.add_argument('--props', default=None, help='The props file (default: the one of the package)')
+    argparser.add_argument('--fsa', default=None, help='The transducer (default: the one of the package)')
+    argparser.add_argument('--max-allowed-anals', dest='max_allowed_anals', type=int, default=None, metavar='N')
+    argparser.add_argument('--max-count', dest='max_count', type=int, default=None,
+                           help='Maximal number of hfst-lookup processes (default: analyzer.max_count in the props file)',
+                           metavar='N')
+    argparser.add_argument('--backend', choices=('hfst-lookup', 'python'), default='hfst-lookup')
+    opts = argparser.parse_args()
+
+    kwargs = {name: value for name, value in (('props', opts.props), ('fsa', opts.fsa),
+                                               ('max_allowed_anals', opts.max_allowed_anals)) if value is not None}
+    emmorph = EmMorphPy(max_count=opts.max_count, backend=opts.backend, cache_size=0, **kwargs)
+    n = build_index(emmorph, read_word_list(opts.input, opts.max_words), opts.output)
+    emmorph.close()
+    print('{0} words are indexed in {1}'.format(n, opts.output), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
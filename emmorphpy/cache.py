@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import threading
+from sys import intern
+from functools import wraps
+from collections import OrderedDict, defaultdict
+
+_morphs = {}  # The shared (lexical, tag, surface) triples of the cached analyses (see compact_anals())
+MAX_SHARED_MORPHS = 1 << 18  # The table is restarted above this size (the cached analyses keep their triples)
+
+
+def compact_anals(anals):
+    """
+    Return the (lemma, tag, danal, hfst_out) anals as a tuple of tuples for the cache: lemma and tag are interned,
+     danal is a tuple of shared (lexical, tag, surface) triples of interned strings, so the frequent strings and morphs
+     are stored only once however many cached words have them
+    """
+    if len(_morphs) > MAX_SHARED_MORPHS:
+        _morphs.clear()
+    morphs_get = _morphs.get
+    compacted = []
+    for lemma, tag, danal, hfst_out in anals:
+        shared_danal = []
+        for morph in danal:
+            shared_morph = morphs_get(morph)
+            if shared_morph is None:
+                shared_morph = tuple(map(intern, morph))
+                _morphs[shared_morph] = shared_morph
+            shared_danal.append(shared_morph)
+        compacted.append((intern(lemma), intern(tag), tuple(shared_danal), hfst_out))
+    return tuple(compacted)
+
+
+class AnalysisCache:
+    """
+    Cache of the analyses of the words with a limited size and statistics
+    Policies: 'lru' discards the Least Recently Used word first,
+     'lfu' the Least Frequently Used one (the least recently used one among the equally frequent ones). The counts
+     are halved after every lfu_aging * maxsize hits and stores, so the words which were frequent only earlier are
+     evicted after a change in the traffic
+    With thread_safe the methods are locked, so more threads can use the cache at the same time
+    """
+    policies = ('lru', 'lfu')
+    lfu_aging = 10
+
+    def __init__(self, maxsize=20000, policy='lru', thread_safe=False):
+        if policy not in self.policies:
+            raise ValueError('No proper cache policy is specified. The available policies are {0}'.
+                             format(' or '.join(self.policies)))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # In LRU order
+        # For LFU: key -> frequency and frequency -> keys in LRU order
+        self._freqs = {}
+        self._freq_keys = defaultdict(OrderedDict)
+        self._min_freq = 0
+        self._lfu_ops = 0  # The hits and stores since the last aging
+        if policy == 'lfu':
+            self.get = self._lfu_get
+            self.put = self._lfu_put
+        if thread_safe:
+            lock = threading.Lock()
+            self.items = self._items_copy
+            for name in ('get', 'put', 'items', 'invalidate', 'clear'):
+                setattr(self, name, self._locked(lock, getattr(self, name)))
+
+    @staticmethod
+    def _locked(lock, fun):
+        @wraps(fun)
+        def locked(*args):
+            with lock:
+                return fun(*args)
+        return locked
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def items(self):
+        return self._data.items()
+
+    def _items_copy(self):
+        return list(self._data.items())  # The view could change while the caller iterates over it
+
+    def get(self, key):
+        """
+        Return the cached value or None
+        """
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        data = self._data
+        data[key] = value
+        data.move_to_end(key)
+        if len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def _lfu_get(self, key):
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._lfu_touch(key)
+        return value
+
+    def _lfu_touch(self, key):
+        self._lfu_count_op()
+        freq = self._freqs[key]
+        keys = self._freq_keys[freq]
+        del keys[key]
+        if len(keys) == 0:
+            del self._freq_keys[freq]
+            if self._min_freq == freq:
+                self._min_freq = freq + 1
+        self._freqs[key] = freq + 1
+        self._freq_keys[freq + 1][key] = None
+
+    def _lfu_put(self, key, value):
+        data = self._data
+        if key in data:
+            data[key] = value
+            self._lfu_touch(key)
+            return
+
+        if len(data) >= self.maxsize > 0:
+            evicted, _ = self._freq_keys[self._min_freq].popitem(last=False)
+            if len(self._freq_keys[self._min_freq]) == 0:
+                del self._freq_keys[self._min_freq]
+            del data[evicted]
+            del self._freqs[evicted]
+            self.evictions += 1
+
+        if self.maxsize > 0:
+            self._lfu_count_op()
+            data[key] = value
+            self._freqs[key] = 1
+            self._freq_keys[1][key] = None
+            self._min_freq = 1
+
+    def _lfu_count_op(self):
+        self._lfu_ops += 1
+        if self._lfu_ops >= self.lfu_aging * self.maxsize:
+            self._lfu_ops = 0
+            self._lfu_age()
+
+    def _lfu_age(self):
+        """
+        Halve the counts (at least 1 remains): the buckets are merged in the order of the old counts, so the
+         less frequent ones are evicted first among the new equal ones (amortised O(1) per operation)
+        """
+        freqs = self._freqs
+        freq_keys = defaultdict(OrderedDict)
+        for freq in sorted(self._freq_keys):
+            new_freq = max(1, freq // 2)
+            new_keys = freq_keys[new_freq]
+            for key in self._freq_keys[freq]:
+                freqs[key] = new_freq
+                new_keys[key] = None
+        self._freq_keys = freq_keys
+        self._min_freq = min(freq_keys, default=0)
+
+    def invalidate(self, key):
+        """
+        Drop the word from the cache (eg. when its extra anals or exceptions are changed)
+        """
+        if self._data.pop(key, None) is not None and self.policy == 'lfu':
+            freq = self._freqs.pop(key)
+            keys = self._freq_keys[freq]
+            del keys[key]
+            if len(keys) == 0:
+                del self._freq_keys[freq]
+                if self._min_freq == freq:
+                    self._min_freq = min(self._freq_keys, default=0)
+
+    def clear(self):
+        self._data.clear()
+        self._freqs.clear()
+        self._freq_keys.clear()
+        self._min_freq = 0
+        self._lfu_ops = 0
+
+    def stats(self):
+        return {'policy': self.policy, 'maxsize': self.maxsize, 'size': len(self._data), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+class WatchedDict(dict):
+    """
+    A dict which calls on_change(key) after the value of a key is changed or deleted (to invalidate the cache)
+    Only the changes through the dict are noticed, in-place changes of the values are not!
+    """
+    def __init__(self, data, on_change):
+        super().__init__(data)
+        self._on_change = on_change
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._on_change(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._on_change(key)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            value = super().pop(key)
+            self._on_change(key)
+            return value
+        return super().pop(key, *default)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._on_change(key)
+        return key, value
+
+    def clear(self):
+        keys = list(self)
+        super().clear()
+        for key in keys:
+            self._on_change(key)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import stat
+import tempfile
+from json import dumps as json_dumps, loads as json_loads
+
+CONFIG_FORMAT = 3  # Must be incremented when the compiled tables change
+
+
+def _path(digest):
+    """
+    In the user cache directory (never next to the props file, which may be in the installed package)
+    """
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')),
+                             'emmorphpy')
+    return os.path.join(cache_dir, '{0}.compiled.json'.format(digest))
+
+
+def _is_trusted(fh):
+    """
+    The file must be owned by the user and not writable by others (else anybody could change the tables)
+    """
+    if not hasattr(os, 'getuid'):
+        return True
+    st = os.fstat(fh.fileno())
+    return st.st_uid == os.getuid() and st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) == 0
+
+
+def load_compiled_config(digest):
+    """
+    Return the compiled tables for the props file with the digest (SHA-256 of its content) or None
+    The tables are stored as JSON: the containers are converted back to the types of _compile_config()
+    """
+    try:
+        with open(_path(digest), encoding='UTF-8') as fh:
+            if not _is_trusted(fh):
+                return None
+            data = json_loads(fh.read())
+        if data['format'] != CONFIG_FORMAT or data['digest'] != digest:
+            return None
+        tag_convert, tag_table, copy2surface, analyzer_conf = data['tables']
+        return (dict(tag_convert), {tag: (tag_replaced, int(props)) for tag, (tag_replaced, props) in tag_table.items()},
+                set(copy2surface), dict(analyzer_conf))
+    except Exception:  # Missing, unreadable or corrupt: compiled again
+        return None
+
+
+def store_compiled_config(digest, tables):
+    """
+    Store the compiled tables atomically. Returns the path or None
+    """
+    tag_convert, tag_table, copy2surface, analyzer_conf = tables
+    data = json_dumps({'format': CONFIG_FORMAT, 'digest': digest,
+                       'tables': [tag_convert, tag_table, sorted(copy2surface), analyzer_conf]}, ensure_ascii=False)
+    path = _path(digest)
+    directory = os.path.dirname(path)
+    tmp_name = None
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', encoding='UTF-8', dir=directory, delete=False) as fh:  # Mode 0600
+            tmp_name = fh.name
+            fh.write(data)
+        os.replace(tmp_name, path)
+        return path
+    except OSError:
+        if tmp_name is not None and os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    return None
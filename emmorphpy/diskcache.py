@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import sqlite3
+import hashlib
+import threading
+from time import time
+from json import dumps as json_dumps, loads as json_loads
+
+
+def fingerprint(files, *extra):
+    """
+    SHA-256 of the content of the files and the extra values (eg. the transducer, the props file and the parameters)
+    """
+    h = hashlib.sha256()
+    for file in files:
+        with open(file, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                h.update(chunk)
+    for value in extra:
+        h.update(repr(value).encode('UTF-8'))
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Persistent cache of the analyses (lemma, tag, danal, hfst_out tuples) in an SQLite database
+    The entries are keyed by the fingerprint of the transducer, the props file and max_allowed_anals, so stale entries
+     are never served (they are evicted first as they are not used anymore). The exceptions of the word are stored
+     with the analyses and a mismatch counts as a miss.
+    Writes (and the usage statistics of the hits) are buffered and written in one transaction (write-behind)
+     after write_batch writes or at flush(). If there are more than max_entries entries at a flush,
+     the least recently used ones are deleted.
+    After fork the child opens its own connection (an SQLite connection must not be used by two processes)
+    """
+    def __init__(self, filename, fingerprint_str, max_entries=1000000, write_batch=1000):
+        self._filename = filename
+        self._fingerprint = fingerprint_str
+        self.max_entries = max_entries
+        self.write_batch = write_batch
+        self._inherited_conns = []  # The connections of the parent after fork (see _check_fork())
+        self._connect()
+
+    def _connect(self):
+        self._pending = {}  # word -> (exceptions, output) not written yet
+        self._used = {}  # word -> last used time for the hits not written yet
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        self._conn = sqlite3.connect(self._filename, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS anals (fingerprint TEXT, word TEXT, exceptions TEXT, '
+                           'output TEXT, hits INTEGER, last_used REAL, PRIMARY KEY (fingerprint, word))')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS anals_last_used ON anals (last_used)')
+        self._conn.commit()
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            # Not closed (nor garbage collected) as it would touch the locks and the WAL of the parent,
+            #  the buffered writes are flushed by the parent
+            self._inherited_conns.append(self._conn)
+            self._connect()
+
+    @staticmethod
+    def _dumps_exceptions(exceptions):
+        return json_dumps(sorted(exceptions), ensure_ascii=False)
+
+    @staticmethod
+    def _loads_output(output_str):
+        return [(lemma, tag, [tuple(morph) for morph in danal], hfst_out)
+                for lemma, tag, danal, hfst_out in json_loads(output_str)]
+
+    def get(self, word, exceptions=()):
+        """
+        Return the stored analyses of the word or None if it is not stored (with the same exceptions)
+        """
+        exceptions_str = self._dumps_exceptions(exceptions)
+        self._check_fork()
+        with self._lock:
+            pending = self._pending.get(word)
+            if pending is not None:
+                return self._loads_output(pending[1]) if pending[0] == exceptions_str else None
+
+            row = self._conn.execute('SELECT exceptions, output FROM anals WHERE fingerprint = ? AND word = ?',
+                                     (self._fingerprint, word)).fetchone()
+            if row is None or row[0] != exceptions_str:
+                return None
+
+            self._used[word] = time()
+            self._flush_if_needed()
+        return self._loads_output(row[1])
+
+    def put(self, word, output, exceptions=()):
+        self._check_fork()
+        with self._lock:
+            self._pending[word] = (self._dumps_exceptions(exceptions), json_dumps(output, ensure_ascii=False))
+            self._flush_if_needed()
+
+    def most_used(self, n):
+        """
+        Return the n most used (word, exceptions, analyses) triples for warm loading (bulk read in one query)
+        """
+        self.flush()
+        with self._lock:
+            rows = self._conn.execute('SELECT word, exceptions, output FROM anals WHERE fingerprint = ? '
+                                      'ORDER BY hits DESC LIMIT ?', (self._fingerprint, n)).fetchall()
+        return [(word, set(json_loads(exceptions_str)), self._loads_output(output_str))
+                for word, exceptions_str, output_str in rows]
+
+    def _flush_if_needed(self):
+        if len(self._pending) + len(self._used) >= self.write_batch:
+            self.flush()
+
+    def flush(self):
+        self._check_fork()
+        with self._lock:
+            if len(self._pending) == 0 and len(self._used) == 0:
+                return
+
+            fingerprint_str = self._fingerprint
+            now = time()
+            with self._conn:  # One transaction
+                self._conn.executemany('INSERT OR REPLACE INTO anals VALUES (?, ?, ?, ?, 1, ?)',
+                                       ((fingerprint_str, word, exceptions_str, output_str, now)
+                                        for word, (exceptions_str, output_str) in self._pending.items()))
+                self._conn.executemany('UPDATE anals SET hits = hits + 1, last_used = ? '
+                                       'WHERE fingerprint = ? AND word = ?',
+                                       ((last_used, fingerprint_str, word) for word, last_used in self._used.items()))
+                no_of_entries = self._conn.execute('SELECT COUNT(*) FROM anals').fetchone()[0]
+                if no_of_entries > self.max_entries:
+                    # The least recently used ones (incl. the ones with other fingerprints)
+                    self._conn.execute('DELETE FROM anals WHERE rowid IN '
+                                       '(SELECT rowid FROM anals ORDER BY last_used LIMIT ?)',
+                                       (no_of_entries - self.max_entries,))
+            self._pending.clear()
+            self._used.clear()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
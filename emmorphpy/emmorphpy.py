@@ -5,37 +5,96 @@ import jprops
 
 import os
 import sys
-
 import functools
-import subprocess
-from collections import defaultdict, OrderedDict
+import hashlib
+import threading
+from io import StringIO
+
+from time import monotonic
+from itertools import islice
+from operator import itemgetter
+from collections import defaultdict, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from json import dumps as json_dumps
 
+from .hfstlookup import HfstLookupPool, HfstLookupError, check_words
+from .hfstol import OptimizedLookup
+from .diskcache import DiskCache, fingerprint
+from .cache import AnalysisCache, WatchedDict, compact_anals
+from .compiledconfig import load_compiled_config, store_compiled_config
+from .metrics import Metrics, prometheus_text
+from .warmup import is_snapshot, read_snapshot, read_word_list, write_snapshot
+from .fullform import FullFormIndex
+from .sharedcache import SharedCache
+from .lexicon import read_lexicon, read_exceptions
+
 morph_flags = {'STEM': 0, 'PREFIX': 1, 'COMP_MEMBER': 2, 'COMP_MUST_HAVE': 3, 'COMP_BEFORE_HYPHEN': 4,
                'STEM_IF_COMP': 5, 'INT_PUNCT': 6}
 
+# The properties of a tag are packed into one integer in the tag table: the flags (bit 1 << morph_flags[flag])
+#  of the replaced tag, the flags of the converted tag (shifted by CONV_FLAGS_SHIFT) and the single bits below
+CONV_FLAGS_SHIFT = 8
+TAG_IS_STEM = 1 << 16
+TAG_COMP_MEMBER = 1 << 17
+TAG_IS_DERIVATIVE = 1 << 18
+TAG_MUST_HAVE_COMPOUND = 1 << 19
+
+TIMEOUT_TAG = '[Timeout]'  # Tag of the extra anal which marks the words whose analysis timed out
+ERROR_TAG = '[Error]'  # Tag of the only anal of the words which could not be analysed (they are not cached at all)
+TRANSIENT_TAGS = (TIMEOUT_TAG, ERROR_TAG)  # The outputs ending with these are not cached or stored
+
+_loaded_configs = {}  # SHA-256 of the props file -> loaded config shared by the instances
+
 
 class EmMorphPy:
     pass_header = True
+    test_at_init = True  # Query a word at init to check hfst-lookup (AsyncEmMorphPy starts its process later)
+    pipeline_window = 64  # Maximal number of words in flight on the pipe in batch mode...
+    pipeline_window_bytes = 16384  # ... and their maximal size in bytes (must be well below the size of the pipe buffer)
+    max_retries = 1  # A word is sent again at most this many times if hfst-lookup exited with it (then it is an error)
+    warm_up_batch = 1000  # The warmed up words are queried and handed over to the cache in batches of this size
+    _warm_up_hooks = ('_spec_query', '_spec_query_many')  # The queries which take over the warmed up analyses
 
     def __init__(self, props=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hfst-wrapper.props'),
                  fsa=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hu.hfstol'), hfst_lookup='hfst-lookup',
                  task='dstem', lexicon=None, exceptions=None, max_allowed_anals=25,
-                 source_fields=None, target_fields=None):
+                 source_fields=None, target_fields=None, max_count=None, timeout_ms=None, backend='hfst-lookup',
+                 disk_cache=None, disk_cache_size=1000000, cache_size=20000, cache_policy='lru', output_fields=None,
+                 json_cache_size=None, metrics=False, warm_up=None, warm_up_size=None, fullform_index=None,
+                 shared_cache=None, shared_cache_size=64, lazy_start=False, thread_safe=False, truncation='drain'):
         self._max_allowed_anals = max_allowed_anals  # Anals after n anals will be discarded!
+        # The discarded anals of hfst-lookup are read and dropped ('drain') or the process is restarted unless the rest
+        #  of them is already read ('restart': the excess anals are not read at all, but the in-flight words are resent)
+        if truncation not in ('drain', 'restart'):
+            raise ValueError('No proper truncation is specified. The available truncations are drain or restart')
+        self._truncation = truncation
+        # Cache for the analyses of cache_size words (see AnalysisCache for the policies). With thread_safe the caches
+        #  are locked, so more threads can call the same instance (every query checks out its own hfst-lookup process
+        #  from the pool, at most max_count of them run at the same time)
+        self.cache = AnalysisCache(cache_size, cache_policy, thread_safe)
+        # Cache for the JSON output of the task of the words in xtsv (default: cache_size words, 0 turns it off)
+        if json_cache_size is None:
+            json_cache_size = cache_size
+        self.json_cache = AnalysisCache(json_cache_size, cache_policy, thread_safe)
         self.loaded_conf = list(self._load_config(props))
-        params = self.loaded_conf.pop()  # HFST params
+        analyzer_conf = self.loaded_conf.pop()  # HFST params and the number of processes
 
         # Specialise the class for eg. stemming or detailed output...
-        available_tasks = {'stem': self._do_stem, 'analyze': self._do_analyze, 'dstem': self._do_dstem}
+        available_tasks = {'stem': self._format_stem_token, 'analyze': self._format_analyze_token,
+                           'dstem': self._format_dstem_token}
         for keyword, key_fun in available_tasks.items():
             if task == keyword:
-                self.process_token = key_fun
+                self._format_token = key_fun
                 break
         else:
             raise ValueError('No proper task is specified. The available tasks are {0}'.
                              format(' or '.join(available_tasks.keys())))
 
+        # The fields of the dstem output (also in xtsv), the others are not computed at all
+        if output_fields is None:
+            output_fields = self.dstem_fields
+        self.output_fields = output_fields
+
         # Init extra anals
         if lexicon is None:
             self._create_extra_lexicon()
@@ -43,23 +102,81 @@ class EmMorphPy:
             self.lexicon = lexicon
 
         # Init exceptional anals
-        if lexicon is None:
+        if exceptions is None:
             self._create_exceptions()
         else:
             self.exceptions = exceptions
 
-        try:
-            self.p = subprocess.Popen([hfst_lookup, *params, fsa], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                      stderr=subprocess.PIPE)
-        except FileNotFoundError:
-            print('ERROR: hfst-lookup not found at: {0} !'.format(hfst_lookup), file=sys.stderr)
-            exit(1)
-
-        # Store frequent methods for easier access
-        self.proc_wait = self.p.wait
-        self.proc_stdin = self.p.stdin
-        self.proc_stdout_readline = self.p.stdout.readline
-        self.proc_stderr_read = self.p.stderr.read
+        if backend == 'hfst-lookup':
+            # The processes are started on demand: overlapping queries and large batches use more of them
+            if max_count is None:
+                max_count = analyzer_conf['max_count']
+            self._pool = HfstLookupPool([hfst_lookup, *analyzer_conf['params'], fsa], max_count)
+            self._query = self._hfst_query
+            self._query_many = self._hfst_query_many
+            self._stems_query = self._hfst_query
+        elif backend == 'python':
+            # In-process lookup in the memory-mapped transducer (needs NumPy)
+            self._pool = None
+            self._hfstol = OptimizedLookup(fsa)
+            self._query = self._hfstol_query
+            self._query_many = self._hfstol_query_many
+            self._stems_query = self._hfstol_query
+        else:
+            raise ValueError('No proper backend is specified. The available backends are hfst-lookup or python')
+        self._executor = None  # Threads to feed the processes of the pool in batch mode (created on demand)
+        self._executor_pid = None
+
+        # The analyses depend on the transducer, the config and max_allowed_anals (see _fingerprint())
+        self._fingerprint_args = ((fsa, props), max_allowed_anals)
+        self._fingerprint_str = None
+
+        # Persistent cache (SQLite file) between the in-memory cache and the backend
+        self._disk_cache = None
+        if disk_cache is not None:
+            self._disk_cache = DiskCache(disk_cache, self._fingerprint(), disk_cache_size)
+            self._backend_query = self._query
+            self._backend_query_many = self._query_many
+            self._query = self._disk_cache_query
+            self._query_many = self._disk_cache_query_many
+
+        # Cache shared by the processes of the host (eg. /dev/shm/emmorphpy, shared_cache_size MB) before the above
+        #  (the fingerprint is appended to the file name, so the different analyzers do not share it)
+        self._shared_cache = None
+        if shared_cache is not None:
+            self._shared_cache = SharedCache('{0}.{1}'.format(shared_cache, self._fingerprint()[:16]),
+                                             shared_cache_size)
+            self._shared_cache_next_query = self._query
+            self._shared_cache_next_query_many = self._query_many
+            self._query = self._shared_cache_query
+            self._query_many = self._shared_cache_query_many
+
+        # Memory-mapped index of the analyses of the frequent words (see buildfullform) before the above
+        self._fullform = None
+        if fullform_index is not None:
+            self._fullform = FullFormIndex(fullform_index)
+            if self._fullform.fingerprint != self._fingerprint():
+                print('WARNING: The full-form index {0} does not match the analyzer (other transducer, config or'
+                      ' max_allowed_anals), it is not used!'.format(fullform_index), file=sys.stderr)
+                self._fullform.close()
+                self._fullform = None
+            else:
+                self._fullform_next_query = self._query
+                self._fullform_next_query_many = self._query_many
+                self._query = self._fullform_query
+                self._query_many = self._fullform_query_many
+
+        # The process is restarted if the analysis of a word takes longer than timeout_ms (0 means no timeout)
+        if timeout_ms is None:
+            timeout_ms = analyzer_conf['timeout_ms']
+        self._timeout = timeout_ms / 1000 if timeout_ms > 0 else None
+        # The counters (and the metrics) are updated under this lock: the batches run in more threads
+        #  (see _hfst_query_many()), and so do the server and the warm-up
+        self._stats_lock = threading.Lock()
+        self.no_of_timeouts = 0  # The words, which ran out of time (and the anals got so far are marked)
+        self.no_of_truncations = 0  # The words, which had more than max_allowed_anals anals
+        self.no_of_filtered_anals = 0  # The anals omitted as exceptions
+        self.no_of_errors = 0  # The words, which could not be analysed (see ERROR_TAG)
 
         # Field names for e-magyar TSV
         if source_fields is None:
@@ -71,29 +188,142 @@ class EmMorphPy:
         self.source_fields = source_fields
         self.target_fields = target_fields
 
-        # Test HFST at init
-        self._spec_query('test')
+        # Test HFST at init. With lazy_start no process is started here: eg. the workers forked from a preloaded
+        #  server share the loaded config and lexicons, but each one starts its own processes on first use
+        if self.test_at_init and not lazy_start:
+            output = self._spec_query('test')
+            if len(output) > 0 and output[0][1] == ERROR_TAG:
+                print('ERROR: hfst-lookup could not analyse a test word!', file=sys.stderr)
+                exit(1)
+
+        # Optional timers and counters of the stages (see stats())
+        self.metrics = Metrics(self) if metrics else None
+
+        # Fill the cache in the background from a snapshot (see dump_cache()) or a frequency-ranked word list
+        self._warm_up_thread = None
+        if warm_up is not None:
+            self._start_warm_up(warm_up, warm_up_size if warm_up_size is not None else self.cache.maxsize)
 
     def process_sentence(self, sen, field_names):
-        for tok in sen:
-            output = self.process_token(tok[field_names[0]])
-            output_json = json_dumps(output, ensure_ascii=False)
+        # The JSON outputs are cached, the other words of the sentence are queried in one pipelined batch
+        inps = [tok[field_names[0]] for tok in sen]
+        outputs, todo = self._json_cache_get_many(inps)
+        if len(todo) > 0:
+            outputs = self._json_cache_put_many(inps, outputs, todo, self._spec_query_many(todo))
+        for tok, output_json in zip(sen, outputs):
             tok.append(output_json)
         return sen
 
+    def process_token(self, token):
+        return self._format_token(self._spec_query(token))
+
     @staticmethod
     def prepare_fields(field_names):
         return [field_names['form']]  # TODO: Maybe its not a good idea to hard-wire here the name of the features
 
-    # These three functions generates JSON output for xtsv. They should not be called from outside
-    def _do_stem(self, token):
-        return self.stem(token, out_mode=lambda x: [self.zip_w_keys(analysis, ('lemma', 'tag')) for analysis in x])
+    # These three functions generates JSON output for xtsv from the analyses of a token.
+    #  They should not be called from outside
+    def _format_stem_token(self, anals):
+        return self._stem_out(anals, lambda x: [self.zip_w_keys(analysis, ('lemma', 'tag')) for analysis in x])
 
-    def _do_analyze(self, token):
-        return self.analyze(token, out_mode=lambda x: [self.zip_w_keys((analysis,), ('morphana',)) for analysis in x])
+    def _format_analyze_token(self, anals):
+        return self._analyze_out(anals, lambda x: [self.zip_w_keys((analysis,), ('morphana',)) for analysis in x])
 
-    def _do_dstem(self, token):
-        return self.dstem(token, out_mode=lambda x: [self.zip_w_keys(analysis) for analysis in x])
+    def _format_dstem_token(self, anals):
+        keys = self.output_fields
+        return self._dstem_out(anals, lambda x: [dict(zip(keys, analysis)) for analysis in x], keys)
+
+    def _json_cache_get_many(self, inps):
+        """
+        The cached JSON outputs of the words (None if missing) and the missing words (once)
+        """
+        json_cache_get = self.json_cache.get
+        outputs = [json_cache_get(inp) for inp in inps]
+        todo = list(OrderedDict.fromkeys(inp for inp, output in zip(inps, outputs) if output is None))
+        return outputs, todo
+
+    def _json_cache_put_many(self, inps, outputs, todo, todo_anals):
+        json_cache_put = self.json_cache.put
+        format_token = self._format_token
+        todo_outputs = {}
+        for inp, anals in zip(todo, todo_anals):
+            output_json = json_dumps(format_token(anals), ensure_ascii=False)
+            if not any(anal[1] in TRANSIENT_TAGS for anal in anals):  # The extra anals of the lexicon are after them
+                json_cache_put(inp, output_json)
+            todo_outputs[inp] = output_json
+        return [todo_outputs[inp] if output is None else output for inp, output in zip(inps, outputs)]
+
+    @property
+    def output_fields(self):
+        return self._output_fields
+
+    @output_fields.setter
+    def output_fields(self, output_fields):
+        output_fields = tuple(output_fields)
+        self._dstem_getters(output_fields)  # Check the field names
+        self._output_fields = output_fields
+        self.json_cache.clear()
+
+    # The extra anals and the exceptions are applied to the cached analyses: the changed words must be dropped
+    @property
+    def lexicon(self):
+        return self._lexicon
+
+    @lexicon.setter
+    def lexicon(self, lexicon):
+        old_lexicon = getattr(self, '_lexicon', None)
+        self._lexicon = WatchedDict(lexicon, self._invalidate) if lexicon is not None else None
+        self._invalidate_changed(old_lexicon, self._lexicon)
+
+    @property
+    def exceptions(self):
+        return self._exceptions
+
+    @exceptions.setter
+    def exceptions(self, exceptions):
+        old_exceptions = getattr(self, '_exceptions', None)
+        self._exceptions = WatchedDict(exceptions, self._invalidate) if exceptions is not None else None
+        self._invalidate_changed(old_exceptions, self._exceptions)
+
+    def _invalidate(self, inp):
+        self.cache.invalidate(inp)
+        self.json_cache.invalidate(inp)
+
+    def _invalidate_changed(self, old, new):
+        """
+        Drop the cached words whose value is not the same in the old and the new lexicon (or exceptions)
+        """
+        if old is None or new is None:
+            self.cache.clear()
+            self.json_cache.clear()
+            return
+        for cache in (self.cache, self.json_cache):
+            for inp in [inp for inp, _ in cache.items() if old.get(inp) != new.get(inp)]:
+                cache.invalidate(inp)
+
+    def load_lexicon(self, filename, replace=False):
+        """
+        Add the extra anals of a TSV file (see lexicon.read_lexicon()) to the lexicon: the anals of the forms in the
+         file are replaced (or the whole lexicon if replace is True). Only the cached outputs of the changed forms are
+         dropped. Returns the number of forms in the file
+        """
+        lexicon = read_lexicon(filename)
+        if replace or self.lexicon is None:
+            self.lexicon = lexicon
+        else:
+            self.lexicon.update(lexicon)
+        return len(lexicon)
+
+    def load_exceptions(self, filename, replace=False):
+        """
+        Add the exceptions of a TSV file (see lexicon.read_exceptions()) as load_lexicon() adds the extra anals
+        """
+        exceptions = read_exceptions(filename)
+        if replace or self.exceptions is None:
+            self.exceptions = exceptions
+        else:
+            self.exceptions.update(exceptions)
+        return len(exceptions)
 
     def _create_extra_lexicon(self):
         """
@@ -148,10 +378,28 @@ class EmMorphPy:
         self.exceptions = {'+': {'+:+ :[/N] :[Nom]'}
                            }
 
+    @classmethod
+    def _load_config(cls, java_props_file):
+        """
+        The config is compiled only once per props file content: the compiled tables are shared between the instances
+         in the process and stored (see compiledconfig) for the later processes, validated by the hash of the content
+        """
+        with open(java_props_file, 'rb') as fh:
+            props_bytes = fh.read()
+        digest = hashlib.sha256(props_bytes).hexdigest()
+        conf = _loaded_configs.get(digest)
+        if conf is None:
+            tables = load_compiled_config(digest)
+            if tables is None:
+                tables = cls._compile_config(props_bytes.decode('UTF-8'))
+                store_compiled_config(digest, tables)
+            conf = cls._bind_config(*tables)
+            _loaded_configs[digest] = conf
+        return conf
+
     @staticmethod
-    def _load_config(java_props_file):
-        with open(java_props_file, encoding='UTF-8') as fp:
-            props = jprops.load_properties(fp)
+    def _compile_config(props_str):
+        props = jprops.load_properties(StringIO(props_str, newline=None))
 
         item_sep = props.get('stemmer.item_sep', ';')
         value_sep = props.get('stemmer.value_sep', '=')
@@ -213,6 +461,25 @@ class EmMorphPy:
             tag_replace_config_must_have_compound[category] = int(COMP_MUST_HAVE in tag_config.get(category, set()) or
                                                                   COMP_MUST_HAVE in flags_conv)
 
+        # Dense tag table: one lookup per morpheme gives the replaced tag and all the packed properties
+        def pack_flags(flags):
+            return sum(1 << flag for flag in flags)
+
+        tag_table = {}
+        for category in set(tag_config) | set(tag_convert) | set(tag_replace):
+            category_replaced = tag_replace.get(category, category)
+            tag_props = pack_flags(tag_replace_config.get(category_replaced, ())) | \
+                pack_flags(tag_convert_config.get(category, ())) << CONV_FLAGS_SHIFT
+            if tag_config_is_stem.get(category, False):
+                tag_props |= TAG_IS_STEM
+            if tag_config_compound_member.get(category, False):
+                tag_props |= TAG_COMP_MEMBER
+            if tag_convert_is_derivative.get(category, False):
+                tag_props |= TAG_IS_DERIVATIVE
+            if tag_replace_config_must_have_compound.get(category_replaced, 0):
+                tag_props |= TAG_MUST_HAVE_COMPOUND
+            tag_table[category] = (category_replaced, tag_props)
+
         # Not used
         # unwanted_patterns = [re.compile(props.get('stemmer.exclude{0}'.format(n)))
         #                      for n in range(100) if props.get('stemmer.exclude{0}'.format(n)) is not None]
@@ -223,19 +490,15 @@ class EmMorphPy:
         if len(hfst_params) > 0:
             hfst_params = hfst_params[:-1]  # Cut the FSA
 
+        analyzer_conf = {'params': hfst_params, 'max_count': int(props.get('analyzer.max_count', 1)),
+                         'timeout_ms': int(props.get('analyzer.timeout_ms', 0))}
+
+        return tag_convert, tag_table, copy2surface, analyzer_conf
+
+    @staticmethod
+    def _bind_config(tag_convert, tag_table, copy2surface, analyzer_conf):
         # Bind methods for faster access
-        tag_config_is_stem = tag_config_is_stem.get
-        tag_config_compound_member = tag_config_compound_member.get
-        tag_convert_is_derivative = tag_convert_is_derivative.get
-        tag_convert_config = tag_convert_config.get
-        tag_replace = tag_replace.get
-        tag_replace_config = tag_replace_config.get
-        tag_replace_config_is_prefix = tag_replace_config_is_prefix.get
-        tag_replace_config_must_have_compound = tag_replace_config_must_have_compound.get
-
-        return tag_convert, tag_replace, tag_config_is_stem, tag_config_compound_member, tag_convert_is_derivative, \
-            tag_convert_config, tag_replace_config, tag_replace_config_is_prefix, \
-            tag_replace_config_must_have_compound, copy2surface, hfst_params
+        return tag_convert, tag_table.get, copy2surface, analyzer_conf
 
     @staticmethod
     def _create_readable_ana(danal):
@@ -259,30 +522,172 @@ class EmMorphPy:
 
     @staticmethod  # TODO: Maybe its not a good idea to hard-wire here the name and order of the features
     def zip_w_keys(values, keys=('lemma', 'tag', 'morphana', 'readable', 'twolevel')):
-        # TODO: From Python 3.7 no need for ordered dict to keep the insertion order
-        # TODO: Its enough to write: {'lemma': lemma, 'tag': tag, 'morphana': danal, 'readable': readable}
-        return OrderedDict(zip(keys, values))
+        return dict(zip(keys, values))  # Keeps the insertion order (CPython 3.6+)
+
+    def stats(self):
+        """
+        The counters of the caches and the backend, with metrics=True also the lookups, the time spent in the stages
+         and the histogram of the number of analyses per word
+        """
+        stats = {'analysis_cache': self.cache.stats(), 'json_cache': self.json_cache.stats(),
+                 'timeouts': self.no_of_timeouts, 'truncations': self.no_of_truncations,
+                 'filtered_anals': self.no_of_filtered_anals, 'errors': self.no_of_errors,
+                 'restarts': self._restarts(), 'crashes': self._crashes()}
+        if self._shared_cache is not None:
+            stats['shared_cache'] = self._shared_cache.stats()
+        if self.metrics is not None:
+            stats.update(self.metrics.stats())
+        return stats
+
+    def prometheus_metrics(self):
+        """
+        stats() in the Prometheus text exposition format
+        """
+        return prometheus_text(self.stats())
+
+    def _restarts(self):
+        return self._pool.restarts if self._pool is not None else 0
+
+    def _crashes(self):
+        return self._pool.crashes if self._pool is not None else 0
 
     def close(self):
-        self.p.wait()
-        try:
-            self.p.kill()
-        except OSError:
-            pass
+        if self._warm_up_thread is not None:  # The running batch is finished before the processes are closed
+            self._warm_up_stopped = True
+            self._warm_up_thread.join()
+        if self._disk_cache is not None:
+            self._disk_cache.close()
+        if self._fullform is not None:
+            self._fullform.close()
+        if self._shared_cache is not None:
+            self._shared_cache.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._pool is not None:
+            self._pool.close()
 
     # Do allow space in stem or detailed analyzis! eg. "jóbarát" -> "jó*** barát"
     def stem(self, inp, out_mode=lambda x: sorted(set(x))):
-        return out_mode((lemma, tag) for lemma, tag, _, _ in self._spec_query(inp))
+        return self._stem_out(self._spec_query(inp), out_mode)
+
+    def first_stems(self, inp, n=1, out_mode=lambda x: sorted(set(x))):
+        """
+        The first n distinct (lemma, tag) pairs in the order of the analyses of hfst-lookup: a prefix of stem(),
+         NOT all lemmas of an ambiguous word. The caches are read as by stem(), an uncached word is analysed only until
+         the n-th pair (see _lemmas_query())
+        """
+        return self._stem_out(self._first_lemmas(self._lemmas_query(inp, n), n), out_mode)
 
     def analyze(self, inp, out_mode=lambda x: sorted(set(x))):
-        return out_mode(self._format_danal(danal) for _, _, danal, _ in self._spec_query(inp))
+        return self._analyze_out(self._spec_query(inp), out_mode)
+
+    def dstem(self, inp, out_mode=lambda x: sorted(set(x)), fields=None):
+        """
+        fields: the fields of the output tuples from dstem_fields (default: output_fields)
+        """
+        return self._dstem_out(self._spec_query(inp), out_mode, fields)
+
+    # Batch versions of the above: the words are pipelined to hfst-lookup, the results are in the order of the input
+    def stem_many(self, inps, out_mode=lambda x: sorted(set(x))):
+        return [self._stem_out(anals, out_mode) for anals in self._spec_query_many(inps)]
+
+    def analyze_many(self, inps, out_mode=lambda x: sorted(set(x))):
+        return [self._analyze_out(anals, out_mode) for anals in self._spec_query_many(inps)]
+
+    def dstem_many(self, inps, out_mode=lambda x: sorted(set(x)), fields=None):
+        return [self._dstem_out(anals, out_mode, fields) for anals in self._spec_query_many(inps)]
+
+    # The output of the above from the analyses of one word
+    @staticmethod
+    def _stem_out(anals, out_mode):
+        return out_mode((lemma, tag) for lemma, tag, _, _ in anals)
 
-    def dstem(self, inp, out_mode=lambda x: sorted(set(x))):
-        return out_mode((lemma, tag, self._format_danal(danal), self._create_readable_ana(danal), hfst_out)
-                        for lemma, tag, danal, hfst_out in self._spec_query(inp))
+    @staticmethod
+    def _first_lemmas(anals, max_lemmas):
+        """
+        The anals until the max_lemmas-th distinct (lemma, tag) pair
+        """
+        lemmas = set()
+        for n, (lemma, tag, _, _) in enumerate(anals, start=1):
+            lemmas.add((lemma, tag))
+            if len(lemmas) >= max_lemmas:
+                return anals[:n]
+        return anals
+
+    def _analyze_out(self, anals, out_mode):
+        return out_mode(self._format_danal(danal) for _, _, danal, _ in anals)
+
+    def _dstem_out(self, anals, out_mode, fields=None):
+        if fields is None:
+            fields = self.output_fields
+        if fields == self.dstem_fields:
+            return out_mode((lemma, tag, self._format_danal(danal), self._create_readable_ana(danal), hfst_out)
+                            for lemma, tag, danal, hfst_out in anals)
+
+        getters = self._dstem_getters(fields)
+        return out_mode(tuple([getter(anal) for getter in getters]) for anal in anals)
+
+    # The fields of dstem computed from the cached (lemma, tag, danal, hfst_out) analyses
+    dstem_fields = ('lemma', 'tag', 'morphana', 'readable', 'twolevel')
+    _dstem_field_getters = {'lemma': itemgetter(0), 'tag': itemgetter(1),
+                            'morphana': lambda anal: EmMorphPy._format_danal(anal[2]),
+                            'readable': lambda anal: EmMorphPy._create_readable_ana(anal[2]),
+                            'twolevel': itemgetter(3)}
+
+    @classmethod
+    def _dstem_getters(cls, fields):
+        try:
+            return [cls._dstem_field_getters[field] for field in fields]
+        except (KeyError, TypeError):
+            raise ValueError('No proper output fields are specified ({0}). The available fields are {1}'.
+                             format(fields, ', '.join(cls.dstem_fields)))
 
     @staticmethod
     def _parse_stem(inp):
+        """
+        Split the symbol pairs of the hfst-lookup output into (lexical, tag, surface) triples
+        """
+        return list(EmMorphPy._parse_pairs(inp))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=100000)
+    def _parse_pairs(inp):
+        """
+        Fast and memoized version of _parse_stem_by_char(): the input is split into pairs at the spaces, the pairs
+         at the colon and the lexical sides at the brackets of the tags. Unusual inputs (spaces as symbols or in tags,
+         pairs without colon, brackets in tags...) are left to _parse_stem_by_char()
+        """
+        items = []
+        item_lexical = ''
+        item_surface = ''
+        for pair in inp.split(' '):
+            surface, colon, lexical = pair.partition(':')
+            if len(colon) == 0:
+                return tuple(EmMorphPy._parse_stem_by_char(inp))
+
+            item_surface += surface
+            if '[' not in lexical:
+                item_lexical += lexical
+                continue
+
+            lexical, *tags_and_lexicals = lexical.split('[')
+            item_lexical += lexical
+            for tag_and_lexical in tags_and_lexicals:
+                tag, bracket, lexical = tag_and_lexical.partition(']')
+                if len(bracket) == 0:
+                    return tuple(EmMorphPy._parse_stem_by_char(inp))
+
+                items.append((item_lexical, tag, item_surface))
+                item_lexical = lexical
+                item_surface = ''
+
+        if len(item_lexical) > 0 or len(item_surface) > 0:
+            items.append((item_lexical, '', item_surface))
+
+        return tuple(items)
+
+    @staticmethod
+    def _parse_stem_by_char(inp):
         item_surface = ''
         item_tag = ''
         item_lexical = ''
@@ -325,16 +730,26 @@ class EmMorphPy:
         return items  # Ez megy a stemmerbe... '+'.join(...)
 
     @staticmethod
-    def _stemmer_process(input_str, tag_convert, tag_replace_get, tag_config_is_stem_get,
-                         tag_config_compound_member_get, tag_convert_is_derivative_get, tag_convert_config_get,
-                         tag_replace_config_get, tag_replace_config_is_prefix_get,
-                         tag_replace_config_must_have_compound_get, copy2surface):
-
-        STEM = 0
-        COMP_MEMBER = 2
-        COMP_BEFORE_HYPHEN = 4
-        STEM_IF_COMP = 5
-        INT_PUNCT = 6
+    def _stemmer_process(input_str, tag_convert, tag_table_get, copy2surface):
+
+        # Flag bits
+        STEM = 1 << 0
+        PREFIX = 1 << 1
+        COMP_MEMBER = 1 << 2
+        COMP_BEFORE_HYPHEN = 1 << 4
+        STEM_IF_COMP = 1 << 5
+        INT_PUNCT = 1 << 6
+        FLAGS_MASK = (1 << CONV_FLAGS_SHIFT) - 1
+
+        # Fields of the morphs (lists are the cheapest to create and index)
+        LEXICAL = 0
+        SURFACE = 1
+        CATEGORY = 2
+        IS_PREFIX = 3
+        IS_STEM = 4
+        IS_DERIVATIVE = 5
+        FLAGS = 6
+        FLAGS_CONV = 7
 
         derivative = False
         must_have_compounds = 0   # how many morphemes with "compound must have" property
@@ -355,25 +770,22 @@ class EmMorphPy:
 
         # bind methods for easier access
         tag_convert_get = tag_convert.get
+        copy2surface_isdisjoint = copy2surface.isdisjoint
 
         for lexical, category, surface in input_str:
-            is_stem = tag_config_is_stem_get(category, False)
-            compound_member = tag_config_compound_member_get(category, False)
-
-            # conversion
-            is_derivative = tag_convert_is_derivative_get(category, False)
-            flags_conv = tag_convert_config_get(category, set())
-
-            # tag replacement
-            category = tag_replace_get(category, category)
-            flags = tag_replace_config_get(category, set())  # Replace if found else keep
-
-            is_prefix = tag_replace_config_is_prefix_get(category, False)
-            must_have_compounds += tag_replace_config_must_have_compound_get(category, 0)
+            # tag replacement and the properties of the tag (the flags of the replaced and the converted tag)
+            category, tag_props = tag_table_get(category, (category, 0))
+            is_stem = tag_props & TAG_IS_STEM != 0
+            compound_member = tag_props & TAG_COMP_MEMBER != 0
+            is_derivative = tag_props & TAG_IS_DERIVATIVE != 0
+            flags = tag_props & FLAGS_MASK
+            flags_conv = tag_props >> CONV_FLAGS_SHIFT & FLAGS_MASK
+            if tag_props & TAG_MUST_HAVE_COMPOUND:
+                must_have_compounds += 1
 
             # copy spec cars from lexical
             lex = lexical
-            if any(c in lex for c in copy2surface):  # else nothing to do :)
+            if not copy2surface_isdisjoint(lex):  # else nothing to do :)
                 surf = surface
                 for i, l_i in enumerate(lex):
                     if l_i in copy2surface:
@@ -390,18 +802,10 @@ class EmMorphPy:
             prev_compound = compound_member
 
             # ha volt már tő és ez képző => a konvertáltjait megkeressük, ha compound member, akkor beállítjuk
-            compound_member |= look_for_compound and COMP_MEMBER in flags_conv
-
-            morph = {'lexical': lexical,
-                     'surface': surface,
-                     'category': category,
-                     'is_prefix': is_prefix,
-                     'is_stem': is_stem,
-                     'is_derivative': is_derivative,
-                     'flags': flags,
-                     'flags_conv': flags_conv}
-            morphs.append(morph)
-            len_morphs = len(morphs)
+            compound_member |= look_for_compound and flags_conv & COMP_MEMBER != 0
+
+            morphs.append([lexical, surface, category, flags & PREFIX != 0, is_stem, is_derivative, flags, flags_conv])
+            len_morphs += 1
 
             if is_stem:
                 if lexical == '-':
@@ -416,12 +820,12 @@ class EmMorphPy:
                     # Mutate list in loop!
                     for i in range(last_stem_code, prev_last_stem_code - 1, -1):
                         m = morphs[i]
-                        convert |= m['is_stem']
-                        if convert and m['is_derivative']:
-                            m['category'] = tag_convert_get(m['category'], m['category'])
-                            fc = m['flags_conv']
-                            m['flags'] = fc
-                            m['is_stem'] |= STEM in fc
+                        convert |= m[IS_STEM]
+                        if convert and m[IS_DERIVATIVE]:
+                            m[CATEGORY] = tag_convert_get(m[CATEGORY], m[CATEGORY])
+                            fc = m[FLAGS_CONV]
+                            m[FLAGS] = fc
+                            m[IS_STEM] |= fc & STEM != 0
 
                 prev_last_stem_code = last_stem_code
                 # első tőalkotó után bekapcsoljuk, ha ez True, akkor keresünk olyan képzőt,
@@ -462,10 +866,10 @@ class EmMorphPy:
             # look for stem if compounds
             for n in range(len_morphs):
                 m = morphs[n]  # Mutate list in loop!
-                if STEM_IF_COMP in m['flags']:
-                    m['is_stem'] = True
-                    m['category'] = tag_convert[m['category']]  # TODO: A None itt nincs kezelve
-                    m['flags'] = m['flags_conv']
+                if m[FLAGS] & STEM_IF_COMP != 0:
+                    m[IS_STEM] = True
+                    m[CATEGORY] = tag_convert[m[CATEGORY]]  # TODO: A None itt nincs kezelve
+                    m[FLAGS] = m[FLAGS_CONV]
                     stem_code = n
                     last_stem_code = max(n, last_stem_code)
 
@@ -479,30 +883,30 @@ class EmMorphPy:
         compound = compounds > 1 and hyphen_pos == -1 or must_have_compounds > 0
         if hyphen_pos > 0 and compound:
             m = morphs[hyphen_pos - 1]
-            if COMP_BEFORE_HYPHEN not in m['flags'] or (hyphen_pos > 1 and len(m['lexical']) == 0 and
-                                                        len(m['surface']) == 0 and
-                                                        not morphs[hyphen_pos - 2]['is_stem']):
+            if m[FLAGS] & COMP_BEFORE_HYPHEN == 0 or (hyphen_pos > 1 and len(m[LEXICAL]) == 0 and
+                                                      len(m[SURFACE]) == 0 and
+                                                      not morphs[hyphen_pos - 2][IS_STEM]):
                 compound = False
 
         internal_punct = False
         # most megmentjuk attol, hogy a PUNCT, PER vegu szavak to tipusa PUNCT legyen
         for n in range(len_morphs-1, 0, -1):
             m = morphs[n]  # Mutate list in loop!
-            if INT_PUNCT not in m['flags']:
+            if m[FLAGS] & INT_PUNCT == 0:
                 break
             internal_punct = True
-            m['is_stem'] = False
+            m[IS_STEM] = False
 
-        while last_stem_code > 0 and not morphs[last_stem_code]['is_stem']:
+        while last_stem_code > 0 and not morphs[last_stem_code][IS_STEM]:
             last_stem_code -= 1
 
         if compound and not sure_compound:  # összetett szavaknál a stemIfCompoundokat átalakítja
             for n in range(len_morphs):
                 m = morphs[n]  # Mutate list in loop!
-                if STEM_IF_COMP in m['flags']:
-                    m['is_stem'] = True
-                    m['category'] = tag_convert[m['category']]  # TODO: A None itt nincs kezelve
-                    m['flags'] = m['flags_conv']
+                if m[FLAGS] & STEM_IF_COMP != 0:
+                    m[IS_STEM] = True
+                    m[CATEGORY] = tag_convert[m[CATEGORY]]  # TODO: A None itt nincs kezelve
+                    m[FLAGS] = m[FLAGS_CONV]
                     if n >= last_stem_code:
                         last_stem_code = n
 
@@ -514,39 +918,39 @@ class EmMorphPy:
         internal_punct_and = True
         if internal_punct and hyphen_pos > 0:
             m = morphs[hyphen_pos - 1]
-            if COMP_BEFORE_HYPHEN in m['flags'] and not (hyphen_pos > 1 and len(m['lexical']) == 0
-                                                         and len(m['surface']) == 0
-                                                         and not morphs[hyphen_pos - 2]['is_stem']):
+            if m[FLAGS] & COMP_BEFORE_HYPHEN != 0 and not (hyphen_pos > 1 and len(m[LEXICAL]) == 0
+                                                           and len(m[SURFACE]) == 0
+                                                           and not morphs[hyphen_pos - 2][IS_STEM]):
                 internal_punct_and = False
 
         # beleégetjük hogy a szóközi kötőjel stem
         for n in range(1, len_morphs-2):
             m = morphs[n]  # Mutate list in loop!
-            m['is_stem'] |= morphs[n - 1]['is_stem'] and morphs[n + 1]['is_stem'] and \
-                (m['surface'] == '-' or m['lexical'] == '-')
+            m[IS_STEM] |= morphs[n - 1][IS_STEM] and morphs[n + 1][IS_STEM] and \
+                (m[SURFACE] == '-' or m[LEXICAL] == '-')
 
         if internal_punct_and and hyphen_pos != -1 and not compound:  # ikerszo (pl. egyet-egyet -> egy-egy)
 
             half = False
-            half_pos = next((z for z in range(max(hyphen_pos - 1, 0), 0, -1) if morphs[z]['is_stem']), stem_code)
+            half_pos = next((z for z in range(max(hyphen_pos - 1, 0), 0, -1) if morphs[z][IS_STEM]), stem_code)
 
             tmp1 = ''
             tmp2 = ''
             for n, m in enumerate(morphs):
-                if m['lexical'] == '-':
+                if m[LEXICAL] == '-':
                     half = True
                     half_pos = last_stem_code
 
-                if m['is_stem']:
-                    if n < half_pos and len(m['surface']) != 0:
-                        sz_stem += m['surface']
+                if m[IS_STEM]:
+                    if n < half_pos and len(m[SURFACE]) != 0:
+                        sz_stem += m[SURFACE]
                     else:
-                        sz_stem += m['lexical']
+                        sz_stem += m[LEXICAL]
                 else:
                     if not half:
-                        tmp1 += m['category'] + ' '
+                        tmp1 += m[CATEGORY] + ' '
                     else:
-                        tmp2 += m['category'] + ' '
+                        tmp2 += m[CATEGORY] + ' '
 
             if tmp1 != tmp2:  # BAD input, stem is dropped
                 sz_stem += '<incorrect word>'
@@ -554,83 +958,512 @@ class EmMorphPy:
         else:  # simple case
             if len_morphs >= last_stem_code:
                 for n, m in enumerate(morphs[:last_stem_code+1]):
-                    if m['is_stem']:
+                    if m[IS_STEM]:
                         if n < last_stem_code:
-                            sz_stem += m['surface']
+                            sz_stem += m[SURFACE]
                         else:
-                            sz_stem += m['lexical']
+                            sz_stem += m[LEXICAL]
 
         if sz_stem.endswith('<incorrect word>'):
             return ()
         else:
-            tag = '[{0}]'.format(']['.join(m['category'] for n, m in enumerate(morphs)
-                                 if n >= last_stem_code or m['is_prefix']))
+            tag = '[{0}]'.format(']['.join(m[CATEGORY] for n, m in enumerate(morphs)
+                                 if n >= last_stem_code or m[IS_PREFIX]))
             return sz_stem, tag
 
-    @functools.lru_cache(maxsize=20000)
     def _spec_query(self, inp):
-        output = []
-        proc_wait = self.proc_wait
-        proc_stdin = self.proc_stdin
-        proc_stdout_readline = self.proc_stdout_readline
-        proc_stderr_read = self.proc_stderr_read
+        output = self.cache.get(inp)
+        if output is not None:
+            return output
 
-        parse_stem = self._parse_stem
-        stemmer_process = self._stemmer_process
-        tag_convert, tag_replace, tag_config_is_stem, tag_config_compound_member, tag_convert_is_derivative, \
-            tag_convert_config, tag_replace_config, tag_replace_config_is_prefix, \
-            tag_replace_config_must_have_compound, copy2surface = self.loaded_conf
+        check_words((inp,))
+        return self._cache_store(inp, self._query(inp))
+
+    def _spec_query_many(self, inps):
+        """
+        Batch version of _spec_query(): cached words are not queried again, the rest is queried in one batch
+        """
+        cache_get = self.cache.get
+        results = {}
+        todo = []
+        for inp in inps:
+            if inp not in results:
+                output = cache_get(inp)
+                if output is None:
+                    todo.append(inp)
+                results[inp] = output
+
+        if len(todo) > 0:
+            check_words(todo)
+            for inp, output in zip(todo, self._query_many(todo)):
+                results[inp] = self._cache_store(inp, output)
+
+        return [results[inp] for inp in inps]
+
+    def _lemmas_query(self, inp, max_lemmas):
+        """
+        Read only version of _spec_query() for first_stems(): the cache, the full-form index, the shared and
+         the disk cache are read in the order of _query() (a hit is cached), but the backend analyses only until the
+         max_lemmas-th distinct (lemma, tag) pair and this truncated output is neither cached nor stored
+        """
+        output = self.cache.get(inp)
+        if output is not None:
+            return output
+
+        check_words((inp,))
+        for layer, get_many in ((self._fullform, self._fullform_get_many),
+                                (self._shared_cache, self._shared_cache_get_many),
+                                (self._disk_cache, self._disk_cache_get_many)):
+            if layer is not None:
+                outputs, todo = get_many((inp,))
+                if len(todo) == 0:
+                    return self._cache_store(inp, outputs[inp])
+        return (*compact_anals(self._stems_query(inp, max_lemmas)), *self.lexicon.get(inp, ()))
+
+    def _fullform_query(self, inp):
+        output = None
+        if inp not in self.exceptions:  # The index is built without exceptions
+            output = self._fullform.get(inp)
+        if output is None:
+            output = self._fullform_next_query(inp)
+        return output
+
+    def _fullform_query_many(self, inps):
+        outputs, todo = self._fullform_get_many(inps)
+        if len(todo) > 0:
+            outputs.update(zip(todo, self._fullform_next_query_many(todo)))
+        return [outputs[inp] for inp in inps]
+
+    def _fullform_get_many(self, inps):
+        """
+        Return the indexed outputs of the words (None if not indexed) and the list of the words to query
+        """
+        fullform_get = self._fullform.get
+        exceptions = self.exceptions
+        outputs = {inp: fullform_get(inp) if inp not in exceptions else None for inp in inps}
+        return outputs, [inp for inp, output in outputs.items() if output is None]
+
+    def _shared_cache_query(self, inp):
+        return self._shared_cache_query_many([inp])[0]
+
+    def _shared_cache_query_many(self, inps):
+        outputs, todo = self._shared_cache_get_many(inps)
+        if len(todo) > 0:
+            self._shared_cache_put_many(outputs, todo, self._shared_cache_next_query_many(todo))
+        return [outputs[inp] for inp in inps]
+
+    def _shared_cache_get_many(self, inps):
+        """
+        Return the shared outputs of the words (None if not stored) and the list of the words to query
+        The words with exceptions are not shared (the other processes may have other exceptions)
+        """
+        shared_cache_get = self._shared_cache.get
+        exceptions = self.exceptions
+        outputs = {inp: shared_cache_get(inp) if inp not in exceptions else None for inp in inps}
+        return outputs, [inp for inp, output in outputs.items() if output is None]
+
+    def _shared_cache_put_many(self, outputs, todo, todo_outputs):
+        shared_cache_put = self._shared_cache.put
+        exceptions = self.exceptions
+        for inp, output in zip(todo, todo_outputs):
+            if inp not in exceptions and (len(output) == 0 or output[-1][1] not in TRANSIENT_TAGS):
+                shared_cache_put(inp, output)
+            outputs[inp] = output
+
+    def _disk_cache_query(self, inp):
+        exceptions = self.exceptions.get(inp, ())
+        output = self._disk_cache.get(inp, exceptions)
+        if output is None:
+            output = self._backend_query(inp)
+            self._disk_cache_put(inp, output, exceptions)
+        return output
 
+    def _disk_cache_query_many(self, inps):
+        outputs, todo = self._disk_cache_get_many(inps)
+        if len(todo) > 0:
+            self._disk_cache_put_many(outputs, todo, self._backend_query_many(todo))
+        return [outputs[inp] for inp in inps]
+
+    def _disk_cache_get_many(self, inps):
+        """
+        Return the stored outputs of the words (None if not stored) and the list of the words to query
+        """
+        disk_cache = self._disk_cache
+        outputs = {inp: disk_cache.get(inp, self.exceptions.get(inp, ())) for inp in inps}
+        return outputs, [inp for inp, output in outputs.items() if output is None]
+
+    def _disk_cache_put_many(self, outputs, todo, todo_outputs):
+        for inp, output in zip(todo, todo_outputs):
+            self._disk_cache_put(inp, output, self.exceptions.get(inp, ()))
+            outputs[inp] = output
+
+    def _disk_cache_put(self, inp, output, exceptions):
+        if len(output) == 0 or output[-1][1] not in TRANSIENT_TAGS:  # Timeouts and errors are not permanent
+            self._disk_cache.put(inp, output, exceptions)
+
+    def _fingerprint(self):
+        if self._fingerprint_str is None:
+            self._fingerprint_str = fingerprint(*self._fingerprint_args)
+        return self._fingerprint_str
+
+    def dump_cache(self, filename):
+        """
+        Write the cached analyses (in LRU order) to a snapshot file for EmMorphPy(warm_up=filename)
+        The extra anals of the lexicon are not stored (they are added at loading) and neither are the timeouts
+        """
+        lexicon = self.lexicon
+        exceptions = self.exceptions
+        entries = []
+        for inp, output in list(self.cache.items()):
+            output = output[:len(output) - len(lexicon.get(inp, ()))]
+            if len(output) == 0 or output[-1][1] not in TRANSIENT_TAGS:
+                entries.append((inp, exceptions.get(inp, ()), output))
+        write_snapshot(filename, self._fingerprint(), entries)
+
+    def _start_warm_up(self, source, n):
+        """
+        The thread only queries the backend (or reads the snapshot): the results are put into the cache by the
+         queries of the caller (_warm_up_hooks are replaced until the warm-up is finished), so the cache is never
+         changed by two threads at the same time
+        """
+        self._warm_up_results = deque()
+        self._warm_up_stopped = False
+        for name in self._warm_up_hooks:
+            setattr(self, name, self._warm_up_hook(getattr(self, name)))
+        self._warm_up_thread = threading.Thread(target=self._warm_up, args=(source, n), daemon=True)
+        self._warm_up_thread.start()
+
+    def _warm_up(self, source, n):
+        results = self._warm_up_results
         try:
-            proc_stdin.write('{0}\n'.format(inp).encode('UTF-8'))
-            proc_stdin.flush()
-        except BrokenPipeError:
-            print(proc_stderr_read().decode('UTF-8').rstrip(), file=sys.stderr)
-            exit(proc_wait())
-
-        # TODO Hack to partially workaround analysing: D-dúr-H-dúr-C-dúr-G-dúr-Esz-dúr-G-dúr-D-dúr which has
-        #  392892 possible analysis in about 1:30 seconds
-        no_of_remaining_allowed_anals = self._max_allowed_anals
+            for snapshot, batch in self._warm_up_batches(source, n):
+                if not snapshot:
+                    exceptions = [frozenset(self.exceptions.get(inp, ())) for inp in batch]
+                    batch = list(zip(batch, exceptions, self._query_many(batch)))
+                results.append(batch)
+        except Exception as e:
+            print('WARNING: Warm-up from {0} failed: {1}'.format(source, e), file=sys.stderr)
+
+    def _warm_up_batches(self, source, n):
+        """
+        The (snapshot, batch) pairs of the warm-up until the end or close(): the batches of the snapshot are
+         (inp, exceptions, output) entries, the batches of the word list are its words which are not in the cache
+        """
+        snapshot = is_snapshot(source)
+        if snapshot:
+            entries = read_snapshot(source, self._fingerprint(), n)
+        else:
+            entries = read_word_list(source, n)
+        while not self._warm_up_stopped:
+            batch = list(islice(entries, self.warm_up_batch))
+            if len(batch) == 0:
+                break
+            if not snapshot:  # Only after the end is checked: a batch of cached words does not stop the warm-up
+                batch = [inp for inp in batch if inp not in self.cache]
+            if len(batch) > 0:
+                yield snapshot, batch
+
+    def _warm_up_hook(self, fun):
+        @functools.wraps(fun)
+        def hooked(*args, **kwargs):
+            self._take_warm_up_results()
+            return fun(*args, **kwargs)
+        return hooked
+
+    def _take_warm_up_results(self):
+        finished = not self._warm_up_thread.is_alive()  # Before taking the results: the last ones are not missed
+        results = self._warm_up_results
         while True:
-            out = ''
             try:
-                out = proc_stdout_readline()
-            except BrokenPipeError:
-                print(proc_stderr_read().decode('UTF-8').rstrip(), file=sys.stderr)
-                exit(proc_wait())
-
-            if len(out) <= 1:
+                batch = results.popleft()  # More threads may take the results at the same time
+            except IndexError:
                 break
-            ret = out.decode('UTF-8').strip().split('\t')
-            if len(ret) == 3 and not ret[1].endswith('+?'):
-                hfst_out = ret[1]
+            self._store_warm_up_batch(batch)
+        if finished:
+            for name in self._warm_up_hooks:
+                self.__dict__.pop(name, None)  # The methods of the class again
+
+    def _store_warm_up_batch(self, batch):
+        cache = self.cache
+        for inp, exceptions, output in batch:
+            if inp not in cache and exceptions == set(self.exceptions.get(inp, ())):
+                self._cache_store(inp, output)
+
+    def warm_up_done(self, timeout=None):
+        """
+        Wait for the warm-up thread (at most timeout seconds) and return True if it is finished
+        The cache gets the results at the next query
+        """
+        if self._warm_up_thread is None:
+            return True
+        self._warm_up_thread.join(timeout)
+        return not self._warm_up_thread.is_alive()
+
+    def load_disk_cache(self, n=None):
+        """
+        Warm up the in-memory cache with the n most used entries of the persistent cache (default: cache size)
+        """
+        if n is None:
+            n = self.cache.maxsize
+        for inp, exceptions, output in self._disk_cache.most_used(n):
+            if exceptions == set(self.exceptions.get(inp, ())):
+                self._cache_store(inp, output)
+
+    def _hfst_query(self, inp, max_lemmas=None):
+        check_words((inp,))
+        proc = self._pool.acquire()
+        try:
+            line = '{0}\n'.format(inp).encode('UTF-8')
+            proc.write(line)
+            proc.flush()
+            try:
+                output = self._hfst_read_anals(proc, inp, max_lemmas)
+            except HfstLookupError as e:
+                output = self._hfst_retry(proc, inp, line, e, max_lemmas)
+        finally:
+            self._pool.release(proc)
+
+        return output
+
+    def _hfst_query_many(self, inps):
+        """
+        The words are pipelined to the processes of the pool (larger batches are split between the idle processes)
+        """
+        pool = self._pool
+        procs = [pool.acquire()]
+        try:
+            while len(procs) * self.pipeline_window < len(inps):
+                proc = pool.acquire(block=False)
+                if proc is None:
+                    break
+                procs.append(proc)
+
+            if len(procs) == 1:
+                outputs = self._pipeline(procs[0], inps)
+            else:
+                if self._executor is None or self._executor_pid != os.getpid():  # Its threads are not forked
+                    self._executor = ThreadPoolExecutor(pool.max_count)
+                    self._executor_pid = os.getpid()
+                chunk_size = -(-len(inps) // len(procs))  # Ceil
+                chunks = [inps[i:i + chunk_size] for i in range(0, len(inps), chunk_size)]
+                outputs = self._pipeline_parallel(procs, chunks)
+        finally:
+            for proc in procs:
+                pool.release(proc)
+
+        return outputs
+
+    def _pipeline_parallel(self, procs, chunks):
+        """
+        Pipeline the chunks to the processes in the threads of the executor
+        All chunks are finished before the processes are released, even if one of them fails
+        """
+        futures = [self._executor.submit(self._pipeline, proc, chunk) for proc, chunk in zip(procs, chunks)]
+        wait(futures)
+        return [output for future in futures for output in future.result()]
+
+    def _hfstol_query(self, inp, max_lemmas=None):
+        return self._process_anals(inp, self._hfstol_anals(inp), max_lemmas)
+
+    def _hfstol_query_many(self, inps):
+        return [self._process_anals(inp, self._hfstol_anals(inp)) for inp in inps]
+
+    def _hfstol_anals(self, inp):
+        """
+        Generator of the analyses of the in-process backend in the format of hfst-lookup (None marks the timeout)
+        """
+        anals, timed_out = self._hfstol.lookup(inp, monotonic() + self._timeout if self._timeout is not None else None)
+        yield from anals
+        if timed_out:
+            with self._stats_lock:
+                self.no_of_timeouts += 1
+            yield None
+
+    def _pipeline(self, proc, inps):
+        """
+        Write many words to hfst-lookup before reading back their analyses
+         (in --pipe-mode each result block is terminated by an empty line, so the blocks come in the order of the words)
+        At most pipeline_window words (and pipeline_window_bytes bytes) are in flight to prevent the deadlock
+         which would occur if both pipes became full
+        The words are checked and encoded before any of them is written: a word with a line break or one which can not
+         be encoded fails the batch before the process gets any of its words (else it would be released with unread
+         output)
+        """
+        check_words(inps)
+        lines = ['{0}\n'.format(inp).encode('UTF-8') for inp in inps]
+        outputs = []
+        in_flight = deque()
+        in_flight_bytes = 0
+        window = self.pipeline_window
+        window_bytes = self.pipeline_window_bytes
+        for inp, line in zip(inps, lines):
+            if len(in_flight) >= window or (len(in_flight) > 0 and in_flight_bytes + len(line) > window_bytes):
+                proc.flush()
+                while len(in_flight) > 0 and (len(in_flight) >= window or in_flight_bytes + len(line) > window_bytes):
+                    in_flight_bytes -= self._read_in_flight(proc, in_flight, outputs)
+
+            proc.write(line)
+            in_flight.append((inp, line))
+            in_flight_bytes += len(line)
+
+        proc.flush()
+        while len(in_flight) > 0:
+            self._read_in_flight(proc, in_flight, outputs)
+
+        return outputs
+
+    def _read_in_flight(self, proc, in_flight, outputs):
+        inp, line = in_flight.popleft()
+        restarts = proc.restarts
+        try:
+            outputs.append(self._hfst_read_anals(proc, inp))
+        except HfstLookupError as e:  # The process exited: the words in flight are lost, they are resent below
+            outputs.append(self._hfst_retry(proc, inp, line, e))
+        except Exception:
+            # To prevent output slipping, the results of the remaining words are dropped
+            for _ in range(len(in_flight) if proc.restarts == restarts else 0):
+                if not proc.skip_anals(monotonic() + self._timeout if self._timeout is not None else None):
+                    self._hfst_timeout(proc)
+                    break
+            raise
+
+        if proc.restarts != restarts:  # The words in flight were lost with the killed process: resend them
+            for _, line_in_flight in in_flight:
+                proc.write(line_in_flight)
+            proc.flush()
+
+        return len(line)
+
+    def _hfst_retry(self, proc, inp, line, error, max_lemmas=None):
+        """
+        Send the word again (at most max_retries times) after the process exited with it or before it
+        Returns an error (an anal tagged ERROR_TAG) if it fails again or the process is not restarted (circuit breaker)
+        """
+        for _ in range(self.max_retries):
+            try:
+                proc.ensure_running()
+                proc.write(line)
+                proc.flush()
+                return self._hfst_read_anals(proc, inp, max_lemmas)
+            except HfstLookupError as e:
+                error = e
+                if not proc.running:
+                    break
+        else:
+            print('WARNING: {0} is skipped: {1}'.format(inp, error), file=sys.stderr)
+        with self._stats_lock:
+            self.no_of_errors += 1
+        return [(inp, ERROR_TAG, '', '')]
+
+    def _cache_store(self, inp, output):
+        # The anals are stored compactly (see compact_anals()), the extra anals are added without any processing
+        #  (parse_stem, stemmer_process)
+        transient = len(output) > 0 and output[-1][1] in TRANSIENT_TAGS
+        output = (*compact_anals(output), *self.lexicon.get(inp, ()))
+
+        if not transient:  # The timeouts and the errors are analysed again at the next query
+            self.cache.put(inp, output)
+
+        return output
+
+    def _hfst_read_anals(self, proc, inp, max_lemmas=None):
+        return self._process_anals(inp, self._hfst_anals(proc, inp), max_lemmas)
+
+    def _hfst_anals(self, proc, inp):
+        """
+        Generator of the analyses of one word read from hfst-lookup (until the terminating empty line)
+        If the word is not finished in time, the process is restarted and None is generated to mark the timeout
+        If the generator is closed earlier, the remaining analyses are dropped (to prevent output slipping) by reading them
+         or by restarting the process (see truncation)
+        """
+        proc_stdout_readline = proc.readline
+        deadline = monotonic() + self._timeout if self._timeout is not None else None
+        out = b''
+        try:
+            while True:
+                out = proc_stdout_readline(deadline)
+                if out is None:
+                    self._hfst_timeout(proc)
+                    yield None
+                    return
+
+                if len(out) <= 1:
+                    if len(out) == 0:  # EOF: the process exited (a new one is started)
+                        raise proc.crashed()
+                    return
+                ret = out.decode('UTF-8').strip().split('\t')
+                if len(ret) == 3 and not ret[1].endswith('+?'):
+                    yield ret[1]
+        finally:
+            if out is not None and len(out) > 1:  # Closed before the end of the block
+                if self._truncation == 'restart':
+                    proc.cancel_anals()
+                elif not proc.skip_anals(deadline):
+                    self._hfst_timeout(proc)
+
+    def _process_anals(self, inp, anals, max_lemmas=None):
+        """
+        Process the analyses of one word (the hfst-lookup outputs generated by anals) with the stemmer
+        On timeout (None in anals) the anals got so far are returned with an extra anal tagged TIMEOUT_TAG
+        If the stemmer fails, only this word fails: its only anal is tagged ERROR_TAG
+        With max_lemmas the rest is dropped after the max_lemmas-th distinct (lemma, tag) pair (see first_stems())
+        """
+        output = []
+        lemmas = set()
+        parse_stem = self._parse_stem
+        stemmer_process = self._stemmer_process
+        tag_convert, tag_table, copy2surface = self.loaded_conf
+        exceptions = self.exceptions.get(inp, {})
+
+        # D-dúr-H-dúr-C-dúr-G-dúr-Esz-dúr-G-dúr-D-dúr has 392892 possible analysis in about 1:30 seconds:
+        #  the anals after max_allowed_anals are discarded (and the process is restarted at the deadline)
+        no_of_remaining_allowed_anals = self._max_allowed_anals
+        no_of_filtered_anals = 0  # Added to the counter once (under the lock)
+        try:
+            for hfst_out in anals:
+                if hfst_out is None:
+                    output.append((inp, TIMEOUT_TAG, '', ''))
+                    break
+
                 no_of_remaining_allowed_anals -= 1
                 if no_of_remaining_allowed_anals <= 0:
-                    while len(out) > 1:
-                        out = proc_stdout_readline()
+                    with self._stats_lock:
+                        self.no_of_truncations += 1
                     break
 
                 # Omit exceptional anals before any processing (parse_stem, stemmer_process)
-                if hfst_out not in self.exceptions.get(inp, {}):
-                    try:
-                        danal = parse_stem(hfst_out)
-                        stem = stemmer_process(danal, tag_convert, tag_replace, tag_config_is_stem,
-                                               tag_config_compound_member, tag_convert_is_derivative,
-                                               tag_convert_config, tag_replace_config, tag_replace_config_is_prefix,
-                                               tag_replace_config_must_have_compound, copy2surface)
-                    except Exception as e:
-                        while len(out) > 1:  # To prevent output slipping
-                            out = proc_stdout_readline()
-                        raise e
+                if hfst_out not in exceptions:
+                    danal = parse_stem(hfst_out)
+                    stem = stemmer_process(danal, tag_convert, tag_table, copy2surface)
 
                     if len(stem) > 0:  # Suppress incorrect words
                         output.append((*stem, danal, hfst_out))  # lemma, tag, danal
-
-        # Add extra anals without any processing (parse_stem, stemmer_process)
-        output.extend(self.lexicon.get(inp, []))
+                        if max_lemmas is not None:
+                            lemmas.add(stem)
+                            if len(lemmas) >= max_lemmas:
+                                break
+                else:
+                    no_of_filtered_anals += 1
+        except HfstLookupError:
+            raise  # The word is retried by the caller
+        except Exception as e:
+            print('WARNING: The analyses of {0} could not be processed: {1!r}'.format(inp, e), file=sys.stderr)
+            with self._stats_lock:
+                self.no_of_errors += 1
+            output = [(inp, ERROR_TAG, '', '')]
+        finally:
+            anals.close()  # Drop the remaining anals
+            if no_of_filtered_anals > 0:
+                with self._stats_lock:
+                    self.no_of_filtered_anals += no_of_filtered_anals
 
         return output
 
+    def _hfst_timeout(self, proc):
+        with self._stats_lock:
+            self.no_of_timeouts += 1
+        proc.restart()
+
     def test(self):
         hfst_out_test = 'a:a l:l :o m:m :[/N] a:a :[Poss.3Sg] :[Nom]'
         danal_test = [('alom', '/N', 'alm'), ('a', 'Poss.3Sg', 'á'), ('val', 'Ins', 'val')]
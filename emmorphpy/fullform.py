@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import sys
+import mmap
+import struct
+import tempfile
+from array import array
+from bisect import bisect_right
+from json import dumps as json_dumps, loads as json_loads
+
+MAGIC = b'EMFFIDX2'  # Change the last character when the format of the index changes
+_header = struct.Struct('<8s64sQ')  # Magic, fingerprint (hex SHA-256), number of words
+
+
+def _dumps_output(output):
+    return json_dumps(output, ensure_ascii=False, separators=(',', ':')).encode('UTF-8')
+
+
+def _loads_output(value):
+    # JSON (not pickle): loading a file written by somebody else can not run code
+    return [(lemma, tag, [tuple(morph) for morph in danal], hfst_out)
+            for lemma, tag, danal, hfst_out in json_loads(value.decode('UTF-8'))]
+
+
+class FullFormIndex:
+    """
+    Read-only, memory-mapped index of the final analyses ((lemma, tag, danal, hfst_out) lists as in the cache)
+     of a word list. The pages are shared between the processes through the page cache
+    Layout (little-endian): header, key offsets (n + 1 uint64), value offsets (n + 1 uint64), the words (UTF-8)
+     in sorted order, the analyses (JSON). A word is looked up by binary search: first in the (in-memory) list
+     of every sample_step-th word, then in the block of the file
+    """
+    sample_step = 64
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fingerprint_bytes, self.size = _header.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError('{0} is not a full-form index (or it has an other format)!'.format(filename))
+        self.fingerprint = fingerprint_bytes.decode('ascii')
+        self._views = []
+        self._key_offsets = self._offsets(_header.size)
+        self._value_offsets = self._offsets(_header.size + 8 * (self.size + 1))
+        self._keys = _header.size + 16 * (self.size + 1)
+        self._samples = [self._key(i) for i in range(0, self.size, self.sample_step)]
+
+    def _offsets(self, start):
+        view = memoryview(self._mm)[start:start + 8 * (self.size + 1)]
+        self._views.append(view)
+        if sys.byteorder == 'little':
+            offsets = view.cast('Q')  # Without copying
+            self._views.append(offsets)
+            return offsets
+        offsets = array('Q', view.tobytes())
+        offsets.byteswap()
+        return offsets
+
+    def __len__(self):
+        return self.size
+
+    def _key(self, i):
+        return self._mm[self._keys + self._key_offsets[i]:self._keys + self._key_offsets[i + 1]]
+
+    def get(self, word):
+        """
+        Return the analyses of the word (a new list) or None if it is not in the index
+        """
+        mm = self._mm
+        key = word.encode('UTF-8')
+        key_offsets = self._key_offsets
+        keys = self._keys
+        lo = bisect_right(self._samples, key) - 1
+        if lo < 0:
+            return None
+        lo *= self.sample_step
+        hi = min(lo + self.sample_step, self.size)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = mm[keys + key_offsets[mid]:keys + key_offsets[mid + 1]]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return _loads_output(mm[self._value_offsets[mid]:self._value_offsets[mid + 1]])
+        return None
+
+    def close(self):
+        self._key_offsets = self._value_offsets = None
+        for view in reversed(self._views):  # The mmap can not be closed while it is exported
+            view.release()
+        self._mm.close()
+
+
+def write_index(filename, fingerprint_str, outputs):
+    """
+    Write the index of the word -> analyses dict atomically (the running instances keep the old file mapped)
+    """
+    items = sorted((word.encode('UTF-8'), _dumps_output(output)) for word, output in outputs.items())
+    n = len(items)
+    keys_size = sum(len(key) for key, _ in items)
+    values_start = _header.size + 16 * (n + 1) + keys_size
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.fullform-')
+    try:
+        os.chmod(tmp_name, 0o644)  # Not only for the owner as mkstemp() creates it
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(_header.pack(MAGIC, fingerprint_str.encode('ascii'), n))
+            for start, parts in ((0, (key for key, _ in items)), (values_start, (value for _, value in items))):
+                offset = start
+                fh.write(struct.pack('<Q', offset))
+                for part in parts:
+                    offset += len(part)
+                    fh.write(struct.pack('<Q', offset))
+            for key, _ in items:
+                fh.write(key)
+            for _, value in items:
+                fh.write(value)
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import sys
+import asyncio
+import threading
+import subprocess
+from time import monotonic
+from select import select
+from collections import deque
+
+
+class HfstLookupError(OSError):
+    """
+    hfst-lookup exited unexpectedly (the words in flight are lost) or it is not restarted (circuit breaker)
+    """
+
+
+def check_words(inps):
+    """
+    The words are written to hfst-lookup one per line: a word with a line break would get more result blocks than
+     one and shift the results of the process, so it is refused (ValueError) before anything is written
+    """
+    for inp in inps:
+        if '\n' in inp or '\r' in inp:
+            raise ValueError('Line break in the word: {0!r}'.format(inp))
+
+
+class HfstLookup:
+    """
+    One hfst-lookup process in --pipe-mode: the analyses of every word written to its stdin are written to its stdout
+     as a block of lines terminated by an empty line
+    If the process exits, it is started again (see crashed()), but if it crashes more than max_crashes times within
+     crash_window seconds, it is not started for cooldown seconds (circuit breaker): meanwhile the writes are dropped
+     and readline() raises HfstLookupError
+    """
+    max_crashes = 5
+    crash_window = 60
+    cooldown = 30
+
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.restarts = 0  # The words in flight are lost at restart, the caller must check this to resend them
+        self.crashes = 0
+        self._crash_times = deque()
+        self._open_until = 0.0
+        self._start()
+
+    def _start(self):
+        try:
+            self.p = subprocess.Popen(self.cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            print('ERROR: hfst-lookup not found at: {0} !'.format(self.cmd[0]), file=sys.stderr)
+            exit(1)
+
+        # Store frequent methods for easier access
+        self.proc_wait = self.p.wait
+        self.proc_stdin_write = self.p.stdin.write
+        self.proc_stdin_flush = self.p.stdin.flush
+        self.proc_stderr_read = self.p.stderr.read
+
+        # stdout is read unbuffered through its file descriptor to be able to wait for it with a timeout
+        self._stdout_fd = self.p.stdout.fileno()
+        self._lines = deque()
+        self._partial_line = b''
+        self.running = True
+
+    def readline(self, deadline=None):
+        """
+        Return the next line (b'' at EOF) or None if the deadline (compared to time.monotonic()) passed before it came
+        """
+        lines = self._lines
+        if len(lines) > 0:
+            return lines.popleft()
+        if not self.running:
+            raise self._unavailable()
+
+        while True:
+            if deadline is not None:
+                timeout = deadline - monotonic()
+                if timeout <= 0 or len(select((self._stdout_fd,), (), (), timeout)[0]) == 0:
+                    return None
+
+            chunk = os.read(self._stdout_fd, 65536)
+            if len(chunk) == 0:  # EOF
+                out, self._partial_line = self._partial_line, b''
+                return out
+
+            chunk = self._partial_line + chunk
+            end = chunk.rfind(b'\n') + 1
+            self._partial_line = chunk[end:]
+            if end > 0:
+                lines.extend(line + b'\n' for line in chunk[:end - 1].split(b'\n'))
+                return lines.popleft()
+
+    def restart(self):
+        """
+        Kill the process (eg. when it is stuck with a word) and start a new one
+        """
+        self.p.kill()
+        self._close_process()
+        self.restarts += 1
+        self._start()
+
+    def crashed(self):
+        """
+        Start a new process after the old one exited (readline() returned EOF) unless the circuit breaker opens
+        Returns the HfstLookupError to raise for the word being read
+        """
+        stderr = self.proc_stderr_read().decode('UTF-8', 'replace').rstrip()
+        error = HfstLookupError('hfst-lookup exited with {0}: {1}'.format(self.proc_wait(), stderr))
+        self._close_process()
+        self.crashes += 1
+        self.restarts += 1
+        now = monotonic()
+        crash_times = self._crash_times
+        crash_times.append(now)
+        while crash_times[0] < now - self.crash_window:
+            crash_times.popleft()
+
+        if len(crash_times) > self.max_crashes:
+            print('WARNING: {0} The process is not restarted for {1} s'.format(error, self.cooldown), file=sys.stderr)
+            self._open_until = now + self.cooldown
+            self._lines.clear()
+            self._partial_line = b''
+            self.running = False
+        else:
+            print('WARNING: {0} Restarting...'.format(error), file=sys.stderr)
+            self._start()
+        return error
+
+    def ensure_running(self):
+        """
+        Start the process again if the cooldown of the circuit breaker is over, else raise HfstLookupError
+        """
+        if not self.running:
+            if monotonic() < self._open_until:
+                raise self._unavailable()
+            self.restarts += 1  # The words written meanwhile were dropped
+            self._start()
+
+    def _unavailable(self):
+        return HfstLookupError('hfst-lookup is not restarted for {0:.0f} s as it crashed {1} times within {2} s'.
+                               format(self._open_until - monotonic(), len(self._crash_times), self.crash_window))
+
+    def write(self, line):
+        if self.running:
+            try:
+                self.proc_stdin_write(line)
+            except BrokenPipeError:
+                pass  # The process exited: readline() gets EOF
+
+    def flush(self):
+        if self.running:
+            try:
+                self.proc_stdin_flush()
+            except BrokenPipeError:
+                pass
+
+    def skip_anals(self, deadline=None):
+        """
+        Drop the remaining analyses of a word. Returns False if the deadline passed in the meantime
+        """
+        out = self.readline(deadline)
+        while out is not None and len(out) > 1:
+            out = self.readline(deadline)
+        return out is not None
+
+    def cancel_anals(self):
+        """
+        Drop the remaining analyses of a word without reading more of the output: if the end of its block is not read
+         yet, the process is restarted (it may be still generating them, eg. millions of analyses)
+        """
+        lines = self._lines
+        while len(lines) > 0:
+            if len(lines.popleft()) <= 1:
+                return
+        self.restart()
+
+    def close(self):
+        if not self.running:  # Closed after the crash
+            return
+        try:
+            self.p.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            self.p.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.p.kill()
+        self._close_process()
+
+    def abandon(self):
+        """
+        Close the pipes inherited from the parent after fork (the process belongs to the parent, it is not waited for)
+        Only the file descriptors are closed: the pipe objects must be kept, as closing them would flush their buffers
+        """
+        if not self.running:
+            return
+        for pipe in (self.p.stdin, self.p.stdout, self.p.stderr):
+            try:
+                os.close(pipe.fileno())
+            except OSError:
+                pass
+
+    def _close_process(self):
+        self.p.wait()
+        for pipe in (self.p.stdin, self.p.stdout, self.p.stderr):
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+
+class HfstLookupPool:
+    """
+    At most max_count hfst-lookup processes started on demand.
+    Every query checks out a process for itself, so overlapping queries never share a pipe
+    After fork the processes of the parent are not used: the child starts its own ones
+    """
+    def __init__(self, cmd, max_count=1):
+        self.cmd = cmd
+        self.max_count = max(1, max_count)
+        self._procs = []
+        self._idle = []
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._abandoned = []  # The processes of the parent (kept, see HfstLookup.abandon())
+
+    def _check_fork(self):
+        if os.getpid() != self._pid:
+            for proc in self._procs:
+                proc.abandon()
+            self._abandoned.extend(self._procs)
+            self._procs = []
+            self._idle = []
+            self._cond = threading.Condition()  # It may have been held by an other thread of the parent
+            self._pid = os.getpid()
+
+    def acquire(self, block=True):
+        """
+        Return an idle process, start a new one if there is none or wait until one is released (if block is True)
+        Returns None if there is no available process and block is False
+        """
+        self._check_fork()
+        with self._cond:
+            while True:
+                if len(self._idle) > 0:
+                    return self._idle.pop()
+                if len(self._procs) < self.max_count:
+                    proc = HfstLookup(self.cmd)
+                    self._procs.append(proc)
+                    return proc
+                if not block:
+                    return None
+                self._cond.wait()
+
+    def release(self, proc):
+        with self._cond:
+            self._idle.append(proc)
+            self._cond.notify()
+
+    @property
+    def restarts(self):
+        return sum(proc.restarts for proc in self._procs)
+
+    @property
+    def crashes(self):
+        return sum(proc.crashes for proc in self._procs)
+
+    def close(self):
+        self._check_fork()
+        with self._cond:
+            for proc in self._procs:
+                proc.close()
+            self._procs = []
+            self._idle = []
+
+
+class AsyncHfstLookup:
+    """
+    One hfst-lookup process driven by asyncio. The words of the concurrent queries are written to the same pipe
+     (in --pipe-mode the result blocks come in the order of the words) and a reader task matches the blocks to them
+    At most max_anals analyses are kept from a block (the rest is read and dropped with truncation='drain', with
+     'restart' it is not read at all) and a word is timed out after timeout seconds: then the process is restarted
+     and the words in flight are resent
+    If the process exits, it is restarted and the words in flight are resent, the first one at most max_retries times
+     (then its result is the HfstLookupError). The circuit breaker works as in HfstLookup
+    If the output of a word can not be read, its result is an HfstLookupError and the process is restarted
+    """
+    max_crashes = HfstLookup.max_crashes
+    crash_window = HfstLookup.crash_window
+    cooldown = HfstLookup.cooldown
+
+    def __init__(self, cmd, max_anals=None, timeout=None, max_retries=1, truncation='drain'):
+        self.cmd = cmd
+        self.max_anals = max_anals
+        self.truncation = truncation
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.restarts = 0
+        self.crashes = 0
+        self._crash_times = deque()
+        self._open_until = 0.0
+        self._first_retries = 0  # The number of crashes with the first pending word
+        self._proc = None
+        self._starting = None
+        self._restarting = False
+        self._reader = None
+        self._pending = deque()  # (line, future) pairs in the order of writing
+        self._has_pending = None
+
+    async def _start(self):
+        try:
+            self._proc = await asyncio.create_subprocess_exec(*self.cmd, stdin=subprocess.PIPE,
+                                                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                              limit=1 << 20)
+        except FileNotFoundError:
+            print('ERROR: hfst-lookup not found at: {0} !'.format(self.cmd[0]), file=sys.stderr)
+            exit(1)
+
+    async def _ensure_started(self):
+        if self._starting is None:  # The first query starts the process and the reader, the others wait for it
+            self._has_pending = asyncio.Event()
+            self._starting = asyncio.ensure_future(self._start())
+            await self._starting
+            self._reader = asyncio.ensure_future(self._read())
+        else:
+            await self._starting
+
+    async def query_many(self, inps):
+        """
+        Return the (analyses, timed_out) pairs of the words, the analyses are the hfst-lookup outputs (symbol pairs),
+         or HfstLookupError for the words which could not be analysed
+        """
+        check_words(inps)
+        await self._ensure_started()
+        if self._proc is None:  # The circuit breaker is open
+            if monotonic() < self._open_until:
+                return [HfstLookupError('hfst-lookup is not restarted for {0:.0f} s as it crashed {1} times within {2}'
+                                        ' s'.format(self._open_until - monotonic(), len(self._crash_times),
+                                                    self.crash_window))] * len(inps)
+            if self._starting.done():  # The first query after the cooldown starts the process, the others wait for it
+                self.restarts += 1
+                self._starting = asyncio.ensure_future(self._start())
+            await self._starting
+
+        loop = asyncio.get_event_loop()
+        futures = []
+        for inp in inps:
+            line = '{0}\n'.format(inp).encode('UTF-8')
+            future = loop.create_future()
+            self._pending.append((line, future))
+            futures.append(future)
+            if not self._restarting:  # Else the line will be sent to the new process
+                self._proc.stdin.write(line)
+        self._has_pending.set()
+        if not self._restarting:
+            await self._drain()
+
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    async def _drain(self):
+        try:
+            await self._proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The reader gets EOF and fails the pending queries
+
+    async def _read(self):
+        """
+        The reader task. If the output of a word can not be read (eg. a line longer than the limit of the stream or
+         a decoding error), the word fails with HfstLookupError and the process is restarted (the task never stops)
+        """
+        pending = self._pending
+        while True:
+            if len(pending) == 0:
+                self._has_pending.clear()
+                await self._has_pending.wait()
+                continue
+
+            try:
+                await self._read_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = HfstLookupError('The output of hfst-lookup could not be read: {0!r}'.format(e))
+                if len(self._pending) > 0:
+                    print('WARNING: {0} is skipped: {1}'.format(self._pending[0][0].decode('UTF-8').rstrip('\n'),
+                                                                  error), file=sys.stderr)
+                await self._restart(error)
+
+    async def _read_next(self):
+        """
+        Read the analyses of the first pending word and set its result (or handle the exit of the process)
+        """
+        anals, timed_out, truncated = await self._read_anals()
+        if anals is None:  # EOF: the process exited
+            await self._crashed()
+            return
+
+        self._first_retries = 0
+        _, future = self._pending.popleft()
+        if not future.done():  # The caller may have been cancelled
+            future.set_result((anals, timed_out))
+        if timed_out or truncated:  # The rest of the block is still in (or coming to) the pipe
+            await self._restart()
+
+    async def _read_anals(self):
+        """
+        Read the analyses of the next word: (anals, timed_out, truncated), anals is None at EOF
+        With truncation='restart' the reading stops at max_anals analyses (truncated)
+        """
+        readline = self._proc.stdout.readline
+        max_anals = self.max_anals
+        stop_at_max = self.truncation == 'restart' and max_anals is not None
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.timeout if self.timeout is not None else None
+        anals = []
+        while True:
+            if deadline is None:
+                out = await readline()
+            else:
+                try:
+                    out = await asyncio.wait_for(readline(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    return anals, True, False
+
+            if len(out) == 0:
+                return None, False, False
+            if len(out) <= 1:
+                return anals, False, False
+            ret = out.decode('UTF-8').strip().split('\t')
+            if len(ret) == 3 and not ret[1].endswith('+?') and (max_anals is None or len(anals) < max_anals):
+                anals.append(ret[1])
+                if stop_at_max and len(anals) == max_anals:
+                    return anals, False, True
+
+    async def _crashed(self):
+        """
+        Restart the process and resend the words in flight, unless the first one crashed it too many times
+         or the circuit breaker opens
+        """
+        self._restarting = True
+        stderr = (await self._proc.stderr.read()).decode('UTF-8', 'replace').rstrip()
+        error = HfstLookupError('hfst-lookup exited with {0}: {1}'.format(await self._proc.wait(), stderr))
+        self.crashes += 1
+        self.restarts += 1
+        now = monotonic()
+        crash_times = self._crash_times
+        crash_times.append(now)
+        while crash_times[0] < now - self.crash_window:
+            crash_times.popleft()
+
+        pending = self._pending
+        self._first_retries += 1
+        if self._first_retries > self.max_retries:
+            self._first_retries = 0
+            line, future = pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+            print('WARNING: {0} is skipped: {1}'.format(line.decode('UTF-8').rstrip('\n'), error), file=sys.stderr)
+
+        if len(crash_times) > self.max_crashes:
+            print('WARNING: {0} The process is not restarted for {1} s'.format(error, self.cooldown), file=sys.stderr)
+            self._open_until = now + self.cooldown
+            self._proc = None
+            while len(pending) > 0:
+                _, future = pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+            self._restarting = False
+            return
+
+        print('WARNING: {0} Restarting...'.format(error), file=sys.stderr)
+        await self._start()
+        for line, _ in pending:
+            self._proc.stdin.write(line)
+        self._restarting = False
+        await self._drain()
+
+    async def _restart(self, error=None):
+        """
+        Kill the process (stuck with a word) and resend the words in flight to a new one
+        With error the first word in flight fails with it (its output could not be read), the others are resent
+        """
+        self._restarting = True
+        if error is not None and len(self._pending) > 0:
+            _, future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+            self._first_retries = 0
+        try:
+            self._proc.kill()
+        except ProcessLookupError:  # Already exited
+            pass
+        await self._proc.wait()
+        self.restarts += 1
+        await self._start()
+        for line, _ in self._pending:
+            self._proc.stdin.write(line)
+        self._restarting = False
+        await self._drain()
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._proc is not None:
+            self._proc.stdin.close()
+            try:
+                await asyncio.wait_for(self._proc.wait(), 1)
+            except asyncio.TimeoutError:
+                self._proc.kill()
+                await self._proc.wait()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import re
+from time import monotonic
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NO_SYMBOL = 0xFFFF
+NO_TABLE_INDEX = 0xFFFFFFFF
+TARGET_TABLE = 0x80000000  # Targets from here point to the transition table (below it to the index table)
+
+header_dtype = [('input_symbols', '<u2'), ('symbols', '<u2'), ('index_size', '<u4'), ('target_size', '<u4'),
+                ('states', '<u4'), ('transitions', '<u4'), ('properties', '<u4', (9,))]
+index_dtype = [('input', '<u2'), ('target', '<u4')]
+transition_dtype = [('input', '<u2'), ('output', '<u2'), ('target', '<u4')]
+transition_w_dtype = [('input', '<u2'), ('output', '<u2'), ('target', '<u4'), ('weight', '<f4')]
+
+flag_diacritic_re = re.compile(r'@([PNRDCU])\.([^.@]+)(?:\.([^@]+))?@$')
+
+
+class _Timeout(Exception):
+    pass
+
+
+class OptimizedLookup:
+    """
+    In-process lookup in a HFST optimized-lookup transducer (hu.hfstol, weighted or unweighted)
+    The file is memory-mapped and its tables are read with NumPy. lookup() returns the same symbol pair strings
+     as hfst-lookup --xfst=print-pairs --xfst=print-space (epsilons as empty strings, flag diacritics hidden)
+     in the same order (by weight then by the symbol pairs) without duplicates
+    """
+    max_path_len = 256  # Guard against infinite epsilon cycles
+
+    def __init__(self, fsa):
+        if np is None:
+            raise ImportError('NumPy is needed for the in-process (python) backend!')
+
+        data = np.memmap(fsa, dtype=np.uint8, mode='r')
+        pos = 0
+        weighted = None
+        if bytes(data[:5]) == b'HFST\0':  # HFST3 header: HFST\0, length (uint16), \0, key\0value\0 pairs
+            header_len = int(np.frombuffer(data, dtype='<u2', count=1, offset=5)[0])
+            header_items = bytes(data[8:8 + header_len]).split(b'\0')
+            header = dict(zip(header_items[0::2], header_items[1::2]))
+            fsa_type = header.get(b'type', b'')
+            if fsa_type not in (b'HFST_OL', b'HFST_OLW'):
+                raise ValueError('Not an optimized-lookup transducer: {0} ({1})!'.format(fsa, fsa_type.decode()))
+            weighted = fsa_type == b'HFST_OLW'
+            pos = 8 + header_len
+
+        header = np.frombuffer(data, dtype=header_dtype, count=1, offset=pos)[0]
+        pos += np.dtype(header_dtype).itemsize
+        if weighted is None:
+            weighted = bool(header['properties'][0])
+        self.weighted = weighted
+
+        # Alphabet: null-terminated UTF-8 strings
+        symbols = []
+        while len(symbols) < header['symbols']:
+            end = pos
+            while data[end] != 0:
+                end += 1
+            symbols.append(bytes(data[pos:end]).decode('UTF-8'))
+            pos = end + 1
+
+        self.sort_symbols = symbols  # The names used by HFST (for ordering)
+        self.print_symbols = [''] + symbols[1:]  # Epsilon is printed as empty string
+        self.flags = {}
+        features = {}
+        values = {}
+        for n, symbol in enumerate(symbols):
+            m = flag_diacritic_re.match(symbol)
+            if m is not None:
+                op, feature, value = m.groups()
+                self.flags[n] = (op, features.setdefault(feature, len(features)),
+                                 values.setdefault(value, len(values) + 1) if value is not None else 0)
+                self.print_symbols[n] = None  # Hidden
+        self.no_of_features = len(features)
+
+        # Input symbols (the first input_symbols ones) for tokenizing the input string (longest match first)
+        self.input_symbols = {symbol: n for n, symbol in enumerate(symbols[:header['input_symbols']])
+                              if n > 0 and n not in self.flags and not symbol.startswith('@_')}
+        self.max_input_symbol_len = max((len(symbol) for symbol in self.input_symbols), default=1)
+
+        index = np.frombuffer(data, dtype=index_dtype, count=header['index_size'], offset=pos)
+        pos += index.nbytes
+        transitions = np.frombuffer(data, dtype=transition_w_dtype if weighted else transition_dtype,
+                                    count=header['target_size'], offset=pos)
+
+        # The columns are copied into native arrays once, as memoryviews of them are the fastest to index from Python
+        self.index_input = memoryview(np.ascontiguousarray(index['input'], dtype=np.uint16))
+        index_target = np.ascontiguousarray(index['target'], dtype=np.uint32)
+        self.index_target = memoryview(index_target)
+        self.index_weight = memoryview(index_target.view(np.float32))  # Final weight of weighted index entries
+        self.transition_input = memoryview(np.ascontiguousarray(transitions['input'], dtype=np.uint16))
+        self.transition_output = memoryview(np.ascontiguousarray(transitions['output'], dtype=np.uint16))
+        self.transition_target = memoryview(np.ascontiguousarray(transitions['target'], dtype=np.uint32))
+        if weighted:
+            self.transition_weight = memoryview(np.ascontiguousarray(transitions['weight'], dtype=np.float32))
+        else:
+            self.transition_weight = None
+
+    def tokenize(self, inp):
+        """
+        Split the input into input symbols (longest match first). Returns None if it contains unknown symbols
+        """
+        input_symbols = self.input_symbols
+        tokens = []
+        pos = 0
+        while pos < len(inp):
+            for end in range(min(len(inp), pos + self.max_input_symbol_len), pos, -1):
+                symbol = input_symbols.get(inp[pos:end])
+                if symbol is not None:
+                    tokens.append(symbol)
+                    pos = end
+                    break
+            else:
+                return None
+        return tokens
+
+    def lookup(self, inp, deadline=None):
+        """
+        Return the list of the symbol pair strings of the analyses and whether the deadline (compared to
+         time.monotonic()) passed (then the list contains only the analyses found so far)
+        """
+        tokens = self.tokenize(inp)
+        if tokens is None:
+            return [], False
+        tokens.append(NO_SYMBOL)
+
+        # Bind tables for faster access
+        index_input = self.index_input
+        index_target = self.index_target
+        index_weight = self.index_weight
+        transition_input = self.transition_input
+        transition_output = self.transition_output
+        transition_target = self.transition_target
+        transition_weight = self.transition_weight
+        index_size = len(index_input)
+        transition_size = len(transition_input)
+        flags = self.flags
+        weighted = self.weighted
+        max_path_len = self.max_path_len
+
+        path = []  # Transition indices
+        results = set()
+        flag_state = [0] * self.no_of_features
+        steps = [0]
+
+        def note_analysis(final_weight):
+            weight = final_weight
+            if weighted:
+                for j in path:
+                    weight += transition_weight[j]
+            results.add((weight, tuple((transition_input[j], transition_output[j]) for j in path
+                                       if transition_input[j] not in flags and
+                                       (transition_input[j] != 0 or transition_output[j] != 0))))
+
+        # A search step is a generator, which yields the (pos, state) of each next step instead of calling it: the
+        #  steps are run from an explicit stack (see below), so long inputs do not reach the recursion limit
+        def get_analyses(pos, i):
+            steps[0] += 1
+            if deadline is not None and steps[0] & 0x3ff == 0 and monotonic() > deadline:
+                raise _Timeout
+            if len(path) > max_path_len:
+                return
+
+            symbol = tokens[pos]
+            if i >= TARGET_TABLE:  # State in the transition table
+                i -= TARGET_TABLE
+                j = i + 1  # The epsilon and flag transitions
+                if symbol == NO_SYMBOL:
+                    if i < transition_size and transition_input[i] == NO_SYMBOL and \
+                            transition_output[i] == NO_SYMBOL and transition_target[i] == 1:
+                        note_analysis(transition_weight[i] if weighted else 0.0)
+                    k = None
+                else:
+                    k = i + 1  # The transitions with the symbol
+            else:  # State in the index table
+                if i + 1 < index_size and index_input[i + 1] == 0:
+                    j = index_target[i + 1] - TARGET_TABLE
+                else:
+                    j = transition_size  # No epsilon transitions
+                k = None
+                if symbol == NO_SYMBOL:
+                    if i < index_size and index_input[i] == NO_SYMBOL:
+                        if weighted:
+                            if index_target[i] != NO_TABLE_INDEX:
+                                note_analysis(index_weight[i])
+                        elif index_target[i] == 1:
+                            note_analysis(0.0)
+                else:
+                    n = i + 1 + symbol
+                    if n < index_size and index_input[n] == symbol:
+                        k = index_target[n] - TARGET_TABLE
+
+            while j < transition_size:
+                input_symbol = transition_input[j]
+                if input_symbol == 0:
+                    path.append(j)
+                    yield pos, transition_target[j]
+                    path.pop()
+                elif input_symbol in flags:
+                    op, feature, value = flags[input_symbol]
+                    old_value = flag_state[feature]
+                    if op == 'P':
+                        flag_state[feature] = value
+                        allowed = True
+                    elif op == 'N':
+                        flag_state[feature] = -value
+                        allowed = True
+                    elif op == 'R':
+                        allowed = old_value == value if value != 0 else old_value != 0
+                    elif op == 'D':
+                        allowed = old_value != value if value != 0 else old_value == 0
+                    elif op == 'C':
+                        flag_state[feature] = 0
+                        allowed = True
+                    else:  # U
+                        allowed = old_value == 0 or old_value == value or (old_value < 0 and -old_value != value)
+                        if allowed:
+                            flag_state[feature] = value
+                    if allowed:
+                        path.append(j)
+                        yield pos, transition_target[j]
+                        path.pop()
+                    flag_state[feature] = old_value
+                else:
+                    break
+                j += 1
+
+            if k is not None:
+                pos += 1
+                while k < transition_size and transition_input[k] == symbol:
+                    path.append(k)
+                    yield pos, transition_target[k]
+                    path.pop()
+                    k += 1
+
+        timed_out = False
+        stack = [get_analyses(0, 0)]
+        push = stack.append
+        pop = stack.pop
+        try:
+            while len(stack) > 0:
+                step = next(stack[-1], None)
+                if step is None:
+                    pop()  # The step is finished: its caller continues
+                else:
+                    push(get_analyses(*step))
+        except _Timeout:
+            timed_out = True
+
+        # Ordered as in hfst-lookup (a set of weight and symbol pair vector pairs)
+        sort_symbols = self.sort_symbols
+        print_symbols = self.print_symbols
+        return [' '.join('{0}:{1}'.format(print_symbols[i], print_symbols[o]) for i, o in pairs)
+                for _, pairs in sorted(results, key=lambda r: (r[0], [(sort_symbols[i], sort_symbols[o])
+                                                                     for i, o in r[1]]))], timed_out
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from sys import intern
+from collections import defaultdict
+
+
+def _tsv_lines(filename, field_counts):
+    """
+    Generate the fields of the lines of the TSV file (empty lines and lines starting with # are skipped)
+    """
+    with open(filename, encoding='UTF-8') as fh:
+        for n, line in enumerate(fh, start=1):
+            line = line.rstrip('\n')
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            fields = line.split('\t')
+            if len(fields) not in field_counts:
+                raise ValueError('Line {0} of {1} has {2} fields instead of {3}: {4!r}'.
+                                 format(n, filename, len(fields), ' or '.join(map(str, field_counts)), line))
+            yield fields
+
+
+def read_lexicon(filename):
+    """
+    Read extra anals from a TSV file with form, lemma, tag and optionally HFST output (twolevel) columns
+     (one anal per line, the anals of a form are in the order of the lines)
+    Returns a form -> tuple of (lemma, tag, '', hfst_out) anals dict. The strings are interned and the equal anals
+     and anal tuples are stored only once, so large lexicons take little memory
+    """
+    anals = {}  # The unique anals and tuples of anals
+    lexicon = defaultdict(list)
+    for fields in _tsv_lines(filename, (3, 4)):
+        form, lemma, tag = fields[:3]
+        anal = (intern(lemma), intern(tag), '', intern(fields[3]) if len(fields) == 4 else '')
+        lexicon[intern(form)].append(anals.setdefault(anal, anal))
+    for form, form_anals in lexicon.items():  # One conversion per form instead of a tuple concatenation per line
+        form_anals = tuple(form_anals)
+        lexicon[form] = anals.setdefault(form_anals, form_anals)
+    return dict(lexicon)
+
+
+def read_exceptions(filename):
+    """
+    Read exceptions from a TSV file with form and HFST output columns (one excepted anal per line)
+    Returns a form -> frozenset of HFST outputs dict (the equal sets are stored only once)
+    """
+    exceptions = defaultdict(set)
+    for form, hfst_out in _tsv_lines(filename, (2,)):
+        exceptions[intern(form)].add(intern(hfst_out))
+    unique = {}
+    for form, hfst_outs in exceptions.items():
+        hfst_outs = frozenset(hfst_outs)
+        exceptions[form] = unique.setdefault(hfst_outs, hfst_outs)
+    return dict(exceptions)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import threading
+from time import perf_counter
+from functools import wraps
+
+
+class Metrics:
+    """
+    Timers and counters of the hot path of an EmMorphPy instance (EmMorphPy(metrics=True))
+    The methods of the stages are wrapped on the instance, so there is no overhead at all without metrics
+    The time of a stage excludes the stages called from the same thread: lookup is the time spent in the backend
+     (or the disk cache) apart from parse_stem and stemmer_process. A batch split between more hfst-lookup processes
+     is timed in the threads of the executor (_pipeline), so the stage times are summed over the threads (they can be
+     more than the wall time). In AsyncEmMorphPy lookup is the wall time of the awaited batches
+    The counters are updated and read under the lock of the instance (more threads may update them)
+    """
+    stages = ('lookup', 'parse_stem', 'stemmer_process', 'formatting', 'serialization')
+    anals_buckets = (0, 1, 2, 4, 8, 16, 32)  # The upper bounds of the buckets of the analyses per word histogram
+
+    def __init__(self, emmorph):
+        self._lock = emmorph._stats_lock  # Shared with the counters of the instance
+        self.stage_seconds = dict.fromkeys(self.stages, 0.0)
+        self.lookups = 0  # The words queried from the backend (the disk cache included)
+        self.anals_counts = [0] * (len(self.anals_buckets) + 1)  # The last bucket is +Inf
+        self.anals_sum = 0
+        self._local = threading.local()  # The time of the called stages in the current thread
+
+        self._wrap(emmorph, '_query', 'lookup', lambda inp: 1)
+        self._wrap(emmorph, '_query_many', 'lookup', len)
+        self._wrap(emmorph, '_stems_query', 'lookup', lambda inp: 1)  # first_stems()
+        self._wrap(emmorph, '_pipeline_parallel', None)  # Not a stage: its time is in the threads (_pipeline)...
+        self._wrap(emmorph, '_pipeline', 'lookup')  # ... which also time their own parse_stem and stemmer_process
+        self._wrap(emmorph, '_parse_stem', 'parse_stem')
+        self._wrap(emmorph, '_stemmer_process', 'stemmer_process')
+        for name in ('_stem_out', '_analyze_out', '_dstem_out'):
+            self._wrap(emmorph, name, 'formatting')
+        self._wrap(emmorph, '_json_cache_put_many', 'serialization')
+        self._wrap_process_anals(emmorph)
+
+    def _wrap(self, emmorph, name, stage, count=None):
+        """
+        Time the method as the stage (without the time of the stages called from it) and count its words
+        Without stage the time is only excluded from the calling stage
+        """
+        fun = getattr(emmorph, name)
+        stage_seconds = self.stage_seconds
+        local = self._local
+        lock = self._lock
+
+        @wraps(fun)
+        def timed(*args, **kwargs):
+            if count is not None:
+                with lock:
+                    self.lookups += count(args[0])
+            outer_children = getattr(local, 'children', 0.0)
+            local.children = 0.0
+            start = perf_counter()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                if stage is not None:
+                    with lock:
+                        stage_seconds[stage] += elapsed - local.children
+                local.children = outer_children + elapsed
+
+        setattr(emmorph, name, timed)
+
+    def wrap_async(self, emmorph, name, stage='lookup'):
+        """
+        Time the coroutine method (the wall time, the called stages are not excluded) and count its words
+        """
+        fun = getattr(emmorph, name)
+        stage_seconds = self.stage_seconds
+        lock = self._lock
+
+        @wraps(fun)
+        async def timed(inps):
+            with lock:
+                self.lookups += len(inps)
+            start = perf_counter()
+            try:
+                return await fun(inps)
+            finally:
+                with lock:
+                    stage_seconds[stage] += perf_counter() - start
+
+        setattr(emmorph, name, timed)
+
+    def _wrap_process_anals(self, emmorph):
+        fun = emmorph._process_anals
+        buckets = self.anals_buckets
+        counts = self.anals_counts
+        lock = self._lock
+
+        @wraps(fun)
+        def counted(inp, anals, *args):
+            output = fun(inp, anals, *args)
+            n = len(output)
+            for i, bound in enumerate(buckets):
+                if n <= bound:
+                    break
+            else:
+                i = len(buckets)  # +Inf
+            with lock:
+                self.anals_sum += n
+                counts[i] += 1
+            return output
+
+        emmorph._process_anals = counted
+
+    def stats(self):
+        with self._lock:  # A consistent snapshot
+            lookups = self.lookups
+            stage_seconds = dict(self.stage_seconds)
+            anals_counts = list(self.anals_counts)
+            anals_sum = self.anals_sum
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.anals_buckets + ('+Inf',), anals_counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'lookups': lookups, 'stage_seconds': stage_seconds,
+                'anals_per_word': {'buckets': buckets, 'count': cumulative, 'sum': anals_sum}}
+
+
+def prometheus_text(stats, prefix='emmorphpy'):
+    """
+    The stats of EmMorphPy.stats() in the Prometheus text exposition format
+    """
+    lines = []
+
+    def metric(name, metric_type, doc, samples):
+        lines.append('# HELP {0}_{1} {2}'.format(prefix, name, doc))
+        lines.append('# TYPE {0}_{1} {2}'.format(prefix, name, metric_type))
+        for suffix, labels, value in samples:
+            label_str = ','.join('{0}="{1}"'.format(k, v) for k, v in labels)
+            lines.append('{0}_{1}{2}{3} {4}'.format(prefix, name, suffix, '{' + label_str + '}' if label_str else '',
+                                                     value))
+
+    caches = [(name, stats[name + '_cache']) for name in ('analysis', 'json', 'shared') if name + '_cache' in stats]
+    metric('cache_hits_total', 'counter', 'Cache hits',
+           [('', (('cache', name),), cache['hits']) for name, cache in caches])
+    metric('cache_misses_total', 'counter', 'Cache misses',
+           [('', (('cache', name),), cache['misses']) for name, cache in caches])
+    metric('cache_evictions_total', 'counter', 'Cache evictions',
+           [('', (('cache', name),), cache['evictions']) for name, cache in caches])
+    metric('cache_size', 'gauge', 'Number of cached words', [('', (('cache', name),), cache['size'])
+                                                             for name, cache in caches if 'size' in cache])
+    metric('timeouts_total', 'counter', 'Words not analysed within the timeout', [('', (), stats['timeouts'])])
+    metric('truncations_total', 'counter', 'Words with more than max_allowed_anals analyses',
+           [('', (), stats['truncations'])])
+    metric('filtered_anals_total', 'counter', 'Analyses omitted as exceptions', [('', (), stats['filtered_anals'])])
+    metric('errors_total', 'counter', 'Words not analysed because of an error', [('', (), stats['errors'])])
+    metric('restarts_total', 'counter', 'Restarts of the hfst-lookup processes', [('', (), stats['restarts'])])
+    metric('crashes_total', 'counter', 'Unexpected exits of the hfst-lookup processes', [('', (), stats['crashes'])])
+
+    if 'lookups' in stats:  # Only with metrics=True
+        metric('lookups_total', 'counter', 'Words queried from the backend', [('', (), stats['lookups'])])
+        metric('stage_seconds_total', 'counter', 'Time spent in the stages of the analysis',
+               [('', (('stage', stage),), seconds) for stage, seconds in stats['stage_seconds'].items()])
+        anals_per_word = stats['anals_per_word']
+        metric('anals_per_word', 'histogram', 'Number of analyses per looked up word',
+               [('_bucket', (('le', bound),), count) for bound, count in anals_per_word['buckets'].items()] +
+               [('_sum', (), anals_per_word['sum']), ('_count', (), anals_per_word['count'])])
+
+    return '\n'.join(lines) + '\n'
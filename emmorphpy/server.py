@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import sys
+import queue
+import argparse
+import threading
+from time import monotonic
+from urllib.parse import unquote
+from email.parser import BytesParser
+from json import dumps as json_dumps
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from .emmorphpy import EmMorphPy
+
+
+class _Request:
+    __slots__ = ('words', 'outputs', 'error', 'done')
+
+    def __init__(self, words):
+        self.words = words
+        self.outputs = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Collect the words of the requests arriving within window_ms (or until max_batch words) and query them
+     as one pipelined batch (the duplicates and the cached words are queried only once by _spec_query_many())
+    Only the batcher thread calls EmMorphPy. At most max_queue requests can wait: submit() raises queue.Full
+     if the queue is still full after queue_timeout seconds (backpressure)
+    """
+    def __init__(self, emmorph, window_ms=2, max_batch=10000, max_queue=1000, queue_timeout=1.0):
+        self.emmorph = emmorph
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.queue_timeout = queue_timeout
+        self._queue = queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, words):
+        """
+        Return the analyses (the cached format of EmMorphPy) of the words when their batch is done
+        """
+        request = _Request(words)
+        self._queue.put(request, timeout=self.queue_timeout)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.outputs
+
+    def _run(self):
+        get = self._queue.get
+        while True:
+            batch = [get()]
+            no_of_words = len(batch[0].words)
+            deadline = monotonic() + self.window
+            while no_of_words < self.max_batch:
+                timeout = deadline - monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                no_of_words += len(request.words)
+            self._process(batch)
+
+    def _process(self, batch):
+        try:
+            outputs = self.emmorph._spec_query_many([word for request in batch for word in request.words])
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        start = 0
+        for request in batch:
+            end = start + len(request.words)
+            request.outputs = outputs[start:end]
+            start = end
+            request.done.set()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(emmorph, batcher, max_body=16 * 1024 * 1024):
+    """
+    GET /<task>/<word> returns {word: output} and POST /<task> (a TSV file with a form column as in xtsv, raw or
+     as the 'file' field of a multipart form) returns the TSV with the output in the anas column,
+     where task is stem, analyze or dstem and the output is the same JSON as in the xtsv (process_sentence) output
+    GET /metrics returns the stats of the analyzer in the Prometheus text format
+    """
+    formatters = {'stem': emmorph._format_stem_token, 'analyze': emmorph._format_analyze_token,
+                  'dstem': emmorph._format_dstem_token}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # Keep-alive
+        disable_nagle_algorithm = True  # The headers and the body are written separately
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send(200, emmorph.prometheus_metrics().encode('UTF-8'), 'text/plain; version=0.0.4')
+                return
+
+            task, _, word = self.path.lstrip('/').partition('/')
+            formatter = formatters.get(task)
+            if formatter is None or len(word) == 0:
+                self._send(404, b'Not found: use /stem/WORD, /analyze/WORD or /dstem/WORD\n', 'text/plain')
+                return
+
+            word = unquote(word)
+            if '\n' in word or '\r' in word:
+                self._send(400, b'Line break in the word\n', 'text/plain')
+                return
+            outputs = self._submit([word])
+            if outputs is not None:
+                body = json_dumps({word: formatter(outputs[0])}, ensure_ascii=False).encode('UTF-8')
+                self._send(200, body, 'application/json; charset=utf-8')
+
+        def do_POST(self):
+            formatter = formatters.get(self.path.strip('/'))
+            if formatter is None:
+                self._send(404, b'Not found: use POST /stem, /analyze or /dstem\n', 'text/plain')
+                return
+
+            # The body is not read on these errors, so the connection can not be kept alive
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                self._send(400, b'Invalid Content-Length\n', 'text/plain', {'Connection': 'close'})
+                return
+            if length > max_body:
+                self._send(413, b'Request too large\n', 'text/plain', {'Connection': 'close'})
+                return
+            lines = self._read_tsv(self.rfile.read(length)).split('\n')
+            header = lines[0].split('\t')
+            if 'form' not in header:
+                self._send(400, b'No form column in the header\n', 'text/plain')
+                return
+            form_index = header.index('form')
+
+            # Empty lines (sentence boundaries) and comments are kept as in xtsv
+            token_lines = [n for n, line in enumerate(lines[1:], start=1) if len(line) > 0 and not line.startswith('#')]
+            words = []
+            for n in token_lines:
+                fields = lines[n].split('\t')
+                if len(fields) != len(header):
+                    self._send(400, 'Line {0} has {1} columns instead of {2}\n'.format(n + 1, len(fields), len(header)).
+                               encode('UTF-8'), 'text/plain')
+                    return
+                if '\r' in fields[form_index]:
+                    self._send(400, 'Line break in the form of line {0}\n'.format(n + 1).encode('UTF-8'), 'text/plain')
+                    return
+                words.append(fields[form_index])
+            outputs = self._submit(words)
+            if outputs is None:
+                return
+            lines[0] += '\tanas'
+            for n, output in zip(token_lines, outputs):
+                lines[n] += '\t' + json_dumps(formatter(output), ensure_ascii=False)
+            self._send(200, '\n'.join(lines).encode('UTF-8'), 'text/tab-separated-values; charset=utf-8')
+
+        def _read_tsv(self, body):
+            content_type = self.headers.get('Content-Type', '')
+            if content_type.startswith('multipart/form-data'):
+                message = BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('latin-1') +
+                                                   b'\r\n\r\n' + body)
+                for part in message.get_payload():
+                    if part.get_param('name', header='content-disposition') == 'file':
+                        body = part.get_payload(decode=True)
+                        break
+                else:
+                    body = b''
+            return body.decode('UTF-8')
+
+        def _submit(self, words):
+            try:
+                return batcher.submit(words)
+            except queue.Full:
+                self._send(503, b'Too many requests, try again later\n', 'text/plain', {'Retry-After': '1'})
+            except Exception as e:
+                self._send(500, '{0}\n'.format(e).encode('UTF-8'), 'text/plain')
+            return None
+
+        def _send(self, code, body, content_type, headers=None):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # No log line for every request
+
+    return Handler
+
+
+def serve(host='127.0.0.1', port=5000, window_ms=2, max_batch=10000, max_queue=1000, **emmorph_kwargs):
+    emmorph = EmMorphPy(thread_safe=True, **emmorph_kwargs)  # The threads of the requests format the outputs
+    batcher = MicroBatcher(emmorph, window_ms, max_batch, max_queue)
+    server = _ThreadingHTTPServer((host, port), make_handler(emmorph, batcher))
+    print('Serving on http://{0}:{1}/'.format(*server.server_address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        emmorph.close()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='emMorphPy HTTP server: the words of the concurrent requests are'
+                                                    ' analysed in shared batches')
+    argparser.add_argument('--host', default='127.0.0.1')
+    argparser.add_argument('--port', type=int, default=5000)
+    argparser.add_argument('--window-ms', dest='window_ms', type=float, default=2,
+                           help='Time to collect the words of the concurrent requests into one batch (default: 2)')
+    argparser.add_argument('--max-batch', dest='max_batch', type=int, default=10000,
+                           help='Maximal number of words in a batch (default: 10000)')
+    argparser.add_argument('--max-queue', dest='max_queue', type=int, default=1000,
+                           help='Maximal number of waiting requests, the others get 503 (default: 1000)')
+    argparser.add_argument('--max-count', dest='max_count', type=int, default=None,
+                           help='Maximal number of hfst-lookup processes (default: analyzer.max_count in the props file)',
+                           metavar='N')
+    argparser.add_argument('--backend', choices=('hfst-lookup', 'python'), default='hfst-lookup')
+    argparser.add_argument('--disk-cache', dest='disk_cache', default=None, metavar='FILE')
+    argparser.add_argument('--shared-cache', dest='shared_cache', default=None,
+                           help='Cache shared by the servers of the host (eg. /dev/shm/emmorphpy)', metavar='FILE')
+    argparser.add_argument('--truncation', choices=('drain', 'restart'), default='drain',
+                           help='Read the analyses after the limit or restart hfst-lookup (default: drain)')
+    argparser.add_argument('--metrics', action='store_true',
+                           help='Time the stages of the analysis (see /metrics, the counters are always there)')
+    opts = argparser.parse_args()
+
+    serve(opts.host, opts.port, opts.window_ms, opts.max_batch, opts.max_queue, max_count=opts.max_count,
+          backend=opts.backend, disk_cache=opts.disk_cache, shared_cache=opts.shared_cache, metrics=opts.metrics,
+          truncation=opts.truncation)
+
+
+if __name__ == '__main__':
+    main()
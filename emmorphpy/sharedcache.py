@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+import os
+import mmap
+import stat
+import fcntl
+import random
+import struct
+import threading
+from zlib import crc32
+from itertools import cycle
+from json import dumps as json_dumps, loads as json_loads
+
+MAGIC = b'EMSHC002'  # Change the number when the layout changes
+_header = struct.Struct('<8sQQQ')  # Magic, number of buckets, ways (slots per bucket), slot size
+_slot_header = struct.Struct('<BxxxIHH')  # State, CRC-32 of the word, length of the word and of the value
+DATA_START = 4096  # The slots start after the header page
+
+EMPTY = 0
+USED = 1
+REFERENCED = 2  # Used since the last time the eviction passed it (second chance)
+
+
+def _is_trusted(fd, mode):
+    """
+    The file must be owned by the user and not writable by others (nor by the group unless mode allows it),
+     else anybody could change the analyses of the other processes (as in compiledconfig)
+    """
+    st = os.fstat(fd)
+    writers = stat.S_IWOTH | (stat.S_IWGRP & ~mode)
+    return stat.S_ISREG(st.st_mode) and st.st_uid == os.getuid() and st.st_mode & writers == 0
+
+
+class SharedCache:
+    """
+    Cache of the analyses shared by the processes of a host (eg. gunicorn workers) in a memory-mapped file
+     (put it on /dev/shm to keep it in memory)
+    The file is a hash table of buckets with a fixed number of fixed-size slots (the words whose analyses (JSON)
+     do not fit are not stored). A full bucket evicts a word not used since the last pass (CLOCK, LRU-ish)
+    The file is created with mode (0o660 shares it with the group of the user) and it is not used if it is owned by
+     an other user or writable by others
+    The buckets are locked with fcntl record locks (shared for reading, exclusive for writing) between the processes
+     and with a lock between the threads of a process
+    """
+    def __init__(self, filename, size_mb=64, slot_size=1024, ways=8, mode=0o600):
+        if not _slot_header.size < slot_size <= 65535:
+            raise ValueError('The slot size must be between {0} and 65535!'.format(_slot_header.size + 1))
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.too_large = 0
+        self._lock = threading.Lock()
+
+        flags = os.O_RDWR | getattr(os, 'O_NOFOLLOW', 0)
+        try:
+            self._fd = os.open(filename, flags | os.O_CREAT | os.O_EXCL, mode)
+            os.fchmod(self._fd, mode)  # Not restricted by the umask
+        except FileExistsError:
+            self._fd = os.open(filename, flags)
+        try:
+            if not _is_trusted(self._fd, mode):
+                raise ValueError('{0} is not owned by the user or it is writable by others,'
+                                 ' it is not used as a shared cache!'.format(filename))
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)  # The first process initialises the file
+            try:
+                if os.fstat(self._fd).st_size == 0:
+                    buckets = max(1, size_mb * 1024 * 1024 // (slot_size * ways))
+                    os.ftruncate(self._fd, DATA_START + buckets * ways * slot_size)  # Zeros: empty slots
+                    os.pwrite(self._fd, _header.pack(MAGIC, buckets, ways, slot_size), 0)
+                magic, self.buckets, self.ways, self.slot_size = _header.unpack(os.pread(self._fd, _header.size, 0))
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+            if magic != MAGIC:
+                raise ValueError('{0} is not a shared cache (or it has an other format)!'.format(filename))
+            self._mm = mmap.mmap(self._fd, 0)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self._bucket_size = self.ways * self.slot_size
+        self._max_data = self.slot_size - _slot_header.size
+
+    def _bucket(self, key):
+        key_crc = crc32(key)
+        return key_crc, DATA_START + (key_crc % self.buckets) * self._bucket_size
+
+    def get(self, word):
+        """
+        Return the analyses of the word (a new list) or None if it is not stored
+        """
+        key = word.encode('UTF-8')
+        key_crc, start = self._bucket(key)
+        mm = self._mm
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_SH, self._bucket_size, start)
+            try:
+                for slot in range(start, start + self._bucket_size, self.slot_size):
+                    state, slot_crc, key_len, value_len = _slot_header.unpack_from(mm, slot)
+                    data = slot + _slot_header.size
+                    if state != EMPTY and slot_crc == key_crc and mm[data:data + key_len] == key:
+                        if state == USED:
+                            mm[slot] = REFERENCED  # Only this byte is written under the shared lock
+                        value = mm[data + key_len:data + key_len + value_len]
+                        break
+                else:
+                    self.misses += 1
+                    return None
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._bucket_size, start)
+            self.hits += 1
+        return [(lemma, tag, [tuple(morph) for morph in danal], hfst_out)
+                for lemma, tag, danal, hfst_out in json_loads(value.decode('UTF-8'))]
+
+    def put(self, word, output):
+        """
+        Store the analyses of the word (if they do not fit, the old ones are dropped)
+        """
+        key = word.encode('UTF-8')
+        value = json_dumps(output, ensure_ascii=False, separators=(',', ':')).encode('UTF-8')
+        fits = len(key) + len(value) <= self._max_data
+        if not fits:
+            self.too_large += 1
+        key_crc, start = self._bucket(key)
+        mm = self._mm
+        slots = range(start, start + self._bucket_size, self.slot_size)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._bucket_size, start)
+            try:
+                target = None
+                for slot in slots:
+                    state, slot_crc, key_len, _ = _slot_header.unpack_from(mm, slot)
+                    data = slot + _slot_header.size
+                    if state == EMPTY:
+                        if target is None:
+                            target = slot
+                    elif slot_crc == key_crc and mm[data:data + key_len] == key:
+                        target = slot  # Replace the old value
+                        break
+                else:
+                    slot = None
+                if not fits:
+                    if slot is not None:
+                        mm[slot] = EMPTY
+                    return
+                if target is None:
+                    target = self._evict(slots)
+                data = target + _slot_header.size
+                mm[data:data + len(key) + len(value)] = key + value
+                _slot_header.pack_into(mm, target, USED, key_crc, len(key), len(value))
+                self.stores += 1
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._bucket_size, start)
+
+    def _evict(self, slots):
+        """
+        Return the first slot not referenced since the last pass (starting from a random one), clearing the
+         references on the way
+        """
+        mm = self._mm
+        first = random.randrange(self.ways)
+        for slot in cycle(list(slots[first:]) + list(slots[:first])):  # Ends in the second round at the latest
+            if mm[slot] == USED:
+                self.evictions += 1
+                return slot
+            mm[slot] = USED
+
+    def stats(self):
+        return {'slots': self.buckets * self.ways, 'slot_size': self.slot_size, 'hits': self.hits,
+                'misses': self.misses, 'stores': self.stores, 'evictions': self.evictions,
+                'too_large': self.too_large}
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+from itertools import islice
+from json import dumps as json_dumps, loads as json_loads
+
+SNAPSHOT_FORMAT = 1  # Increment when the format of the snapshots changes
+
+
+def is_snapshot(filename):
+    with open(filename, encoding='UTF-8') as fh:
+        return fh.readline().startswith('{"emmorphpy_snapshot"')
+
+
+def write_snapshot(filename, fingerprint_str, entries):
+    """
+    Write the (word, exceptions, analyses) triples as JSON lines after a header with the fingerprint of the analyzer
+    """
+    with open(filename, 'w', encoding='UTF-8') as fh:
+        fh.write(json_dumps({'emmorphpy_snapshot': SNAPSHOT_FORMAT, 'fingerprint': fingerprint_str}))
+        fh.write('\n')
+        for word, exceptions, output in entries:
+            fh.write(json_dumps([word, sorted(exceptions), output], ensure_ascii=False))
+            fh.write('\n')
+
+
+def read_snapshot(filename, fingerprint_str, n=None):
+    """
+    Generate the first n (word, exceptions, analyses) triples of the snapshot
+    Raises ValueError if it was dumped with an other format, transducer, config or max_allowed_anals
+    """
+    with open(filename, encoding='UTF-8') as fh:
+        header = json_loads(fh.readline())
+        if header.get('emmorphpy_snapshot') != SNAPSHOT_FORMAT or header.get('fingerprint') != fingerprint_str:
+            raise ValueError('The snapshot {0} does not match the analyzer (other format, transducer, config or'
+                             ' max_allowed_anals)'.format(filename))
+        for line in islice(fh, n):
+            word, exceptions, output = json_loads(line)
+            yield word, frozenset(exceptions), [(lemma, tag, [tuple(morph) for morph in danal], hfst_out)
+                                                for lemma, tag, danal, hfst_out in output]
+
+
+def read_word_list(filename, n=None):
+    """
+    Generate the first n different words of a frequency-ranked word list (one word per line, the fields after
+     the first tab, eg. the frequency, are ignored)
+    """
+    seen = set()
+    with open(filename, encoding='UTF-8') as fh:
+        for line in fh:
+            word = line.rstrip('\n').split('\t', 1)[0]
+            if len(word) > 0 and word not in seen:
+                seen.add(word)
+                yield word
+                if n is not None and len(seen) >= n:
+                    return
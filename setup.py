@@ -40,10 +40,13 @@ setuptools.setup(
     install_requires=['xtsv>=1.0.0,<2.0.0',
                       'jprops',
                       ],
+    extras_require={'python-backend': ['numpy']},
     include_package_data=True,
     entry_points={
         'console_scripts': [
             'emmorphpy=emmorphpy.__main__:main',
+            'emmorphpy-server=emmorphpy.server:main',
+            'emmorphpy-build-fullform=emmorphpy.buildfullform:main',
         ]
     },
 )
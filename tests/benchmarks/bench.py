@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Benchmark of stem, analyze and dstem over a word list (one word per line)
+Every task is run in a fresh process (for its own peak RSS) with the same steps:
+ - cold: the words one by one (as xtsv calls process_token) with an empty cache
+ - warm: the same words again (every word is cached)
+ - batch: the words in batches (*_many methods) with an empty cache
+The results (words/sec, latency percentiles in microseconds, time split across the stages, peak RSS in KiB)
+ are written as JSON (with more hfst-lookup processes the stage times of the batches are summed over the threads).
+With --baseline the throughputs are compared to a previous result and the exit code is 1 if any of them dropped
+ more than the tolerance
+"""
+
+import sys
+import json
+import argparse
+import platform
+import resource
+import subprocess
+from time import perf_counter
+from functools import wraps
+
+from emmorphpy import EmMorphPy, __version__
+
+TASKS = ('stem', 'analyze', 'dstem')
+
+
+class StageTimer:
+    """
+    Accumulate the time spent in the wrapped methods of an EmMorphPy instance
+    """
+    def __init__(self, emmorph):
+        self.times = {}
+        for name in ('_spec_query', '_spec_query_many', '_parse_stem', '_stemmer_process'):
+            setattr(emmorph, name, self._wrap(name, getattr(emmorph, name)))
+
+    def _wrap(self, name, fun):
+        times = self.times
+        times[name] = 0.0
+
+        @wraps(fun)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                times[name] += perf_counter() - start
+        return timed
+
+    def reset(self):
+        for name in self.times:
+            self.times[name] = 0.0
+
+    def stages(self, total):
+        """
+        Split the total time: the queries contain the lookup (pipe I/O), the parsing and the stemming,
+         the rest is the formatting of the output
+        """
+        query = self.times['_spec_query'] + self.times['_spec_query_many']
+        parse_stem = self.times['_parse_stem']
+        stemmer_process = self.times['_stemmer_process']
+        return {'lookup': max(query - parse_stem - stemmer_process, 0.0), 'parse_stem': parse_stem,
+                'stemmer_process': stemmer_process, 'formatting': max(total - query, 0.0)}
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    n = len(latencies)
+    return {'p{0}'.format(q): latencies[min(int(q / 100 * n), n - 1)] * 1e6 if n > 0 else None for q in (50, 95, 99)}
+
+
+def summary(n, total, timer, latencies=None):
+    result = {'words': n, 'seconds': total, 'words_per_sec': n / total if total > 0 else None,
+              'stages_sec': timer.stages(total)}
+    if latencies is not None:
+        result['latency_us'] = percentiles(latencies)
+    return result
+
+
+def run_one_by_one(emmorph, words):
+    process_token = emmorph.process_token
+    latencies = []
+    start = perf_counter()
+    for word in words:
+        word_start = perf_counter()
+        json.dumps(process_token(word), ensure_ascii=False)
+        latencies.append(perf_counter() - word_start)
+    return perf_counter() - start, latencies
+
+
+def run_batches(emmorph, task, words, batch_size):
+    task_many = getattr(emmorph, '{0}_many'.format(task))
+    start = perf_counter()
+    for i in range(0, len(words), batch_size):
+        for output in task_many(words[i:i + batch_size], out_mode=list):
+            json.dumps(output, ensure_ascii=False)
+    return perf_counter() - start
+
+
+def bench_task(task, words, args):
+    start = perf_counter()
+    emmorph = EmMorphPy(task=task, backend=args.backend, max_count=args.max_count, cache_size=len(words) + 1)
+    init_time = perf_counter() - start
+    emmorph.cache.clear()  # Drop the test word of the init
+    timer = StageTimer(emmorph)
+
+    result = {'init_sec': init_time}
+    total, latencies = run_one_by_one(emmorph, words)
+    result['cold'] = summary(len(words), total, timer, latencies)
+
+    timer.reset()
+    total, latencies = run_one_by_one(emmorph, words)
+    result['warm'] = summary(len(words), total, timer, latencies)
+
+    emmorph.cache.clear()
+    timer.reset()
+    total = run_batches(emmorph, task, words, args.batch_size)
+    result['batch'] = summary(len(words), total, timer)
+    result['batch']['batch_size'] = args.batch_size
+
+    emmorph.close()  # The hfst-lookup processes are waited for: their RSS is counted below
+    result['peak_rss_kib'] = {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                              'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the throughput ratios to the baseline and return the list of regressions
+    """
+    regressions = []
+    for task, task_result in results['tasks'].items():
+        for step in ('cold', 'warm', 'batch'):
+            old = baseline.get('tasks', {}).get(task, {}).get(step, {}).get('words_per_sec')
+            new = task_result[step]['words_per_sec']
+            if old is None or new is None:
+                continue
+            ratio = new / old
+            print('{0}\t{1}\t{2:.0f} -> {3:.0f} words/sec ({4:+.1%})'.format(task, step, old, new, ratio - 1),
+                  file=sys.stderr)
+            if ratio < 1 - tolerance:
+                regressions.append((task, step))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-i', '--input', default='tests/inputs/test_words.in', help='One word per line')
+    parser.add_argument('-o', '--output', default='-', help='The JSON output (default: STDOUT)')
+    parser.add_argument('--tasks', nargs='+', choices=TASKS, default=TASKS)
+    parser.add_argument('--limit', type=int, default=None, help='Use only the first N words', metavar='N')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=10000)
+    parser.add_argument('--backend', choices=('hfst-lookup', 'python'), default='hfst-lookup')
+    parser.add_argument('--max-count', dest='max_count', type=int, default=None)
+    parser.add_argument('--baseline', default=None, help='Previous JSON output to compare with', metavar='FILE')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative drop of the throughput compared to the baseline (default: 0.1)')
+    parser.add_argument('--child', default=None, choices=TASKS, help=argparse.SUPPRESS)  # Run one task only
+    args = parser.parse_args()
+
+    with open(args.input, encoding='UTF-8') as fh:
+        words = [line.strip() for line in fh][:args.limit]
+
+    if args.child is not None:
+        json.dump(bench_task(args.child, words, args), sys.stdout)
+        return
+
+    results = {'version': __version__, 'python': platform.python_version(), 'platform': platform.platform(),
+               'input': args.input, 'backend': args.backend, 'max_count': args.max_count, 'tasks': {}}
+    for task in args.tasks:
+        print('Benchmarking {0}...'.format(task), file=sys.stderr)
+        cmd = [sys.executable, __file__, '--child', task, '-i', args.input, '--batch-size', str(args.batch_size),
+               '--backend', args.backend]
+        if args.limit is not None:
+            cmd.extend(('--limit', str(args.limit)))
+        if args.max_count is not None:
+            cmd.extend(('--max-count', str(args.max_count)))
+        results['tasks'][task] = json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout)
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w', encoding='UTF-8') as fh:
+            json.dump(results, fh, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, encoding='UTF-8') as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        if len(regressions) > 0:
+            print('Regressions: {0}'.format(', '.join('{0} {1}'.format(*r) for r in regressions)), file=sys.stderr)
+            exit(1)
+
+
+if __name__ == '__main__':
+    main()
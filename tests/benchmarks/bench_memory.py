@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Memory benchmark of the in-memory cache: bytes per cached word of the analyses of the unique words of the corpus
+The same entries are also measured in the uncompacted layout (lists and separate strings for every entry) to compare
+"""
+
+import gc
+import sys
+import argparse
+import tracemalloc
+from collections import OrderedDict
+
+from emmorphpy import EmMorphPy
+
+
+def traced(build):
+    """
+    The memory allocated by build() and still in use after it (the result is kept until the measurement)
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def fresh(s):
+    return s.encode('UTF-8').decode('UTF-8')  # An equal but separate string object
+
+
+def uncompacted(entries):
+    """
+    The entries as lists of analyses with separate strings and lists of morphs (as in every entry before interning)
+    """
+    return OrderedDict((fresh(inp), [(fresh(lemma), fresh(tag), [tuple(fresh(s) for s in morph) for morph in danal],
+                           fresh(hfst_out)) for lemma, tag, danal, hfst_out in output])
+                       for inp, output in entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', '--input', default='tests/inputs/test_words.in', help='One word per line')
+    args = parser.parse_args()
+
+    with open(args.input, encoding='UTF-8') as fh:
+        words = sorted({line.strip() for line in fh if len(line.strip()) > 0})
+
+    emmorph = EmMorphPy(cache_size=len(words), json_cache_size=0)
+    emmorph.cache.clear()
+
+    def fill():
+        emmorph.dstem_many(words)
+        emmorph._parse_pairs.cache_clear()  # Only the memory kept by the cache is measured
+        return None
+
+    cache_size, _ = traced(fill)
+    no_of_words = len(emmorph.cache)
+    entries = list(emmorph.cache.items())
+    emmorph.close()
+    uncompacted_size, _ = traced(lambda: uncompacted(entries))
+
+    no_of_anals = sum(len(output) for _, output in entries)
+    print('{0} cached words ({1:.2f} analyses per word)'.format(no_of_words, no_of_anals / max(no_of_words, 1)))
+    print('Cache:       {0:10.1f} bytes per word ({1:.1f} MB)'.format(cache_size / max(no_of_words, 1), cache_size / 1e6))
+    print('Uncompacted: {0:10.1f} bytes per word ({1:.1f} MB)'.format(uncompacted_size / max(no_of_words, 1),
+                                                                      uncompacted_size / 1e6))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Micro-benchmark of the stemmer (_parse_stem and _stemmer_process) over the analyses of the test corpus
+The analyses are collected with hfst-lookup first, then only the stemmer is timed (best of --repeat runs)
+"""
+
+import sys
+import argparse
+from time import perf_counter
+
+from emmorphpy import EmMorphPy
+
+
+def collect_anals(emmorph, words):
+    """
+    The hfst-lookup outputs of the unique words (the last field of the dstem output)
+    """
+    return [anal[-1] for anals in emmorph.dstem_many(sorted(set(words)), out_mode=list) for anal in anals
+            if len(anal[-1]) > 0]
+
+
+def best_time(fun, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fun()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', '--input', default='tests/inputs/test_words.in', help='One word per line')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs (the best one counts)')
+    args = parser.parse_args()
+
+    emmorph = EmMorphPy()
+    with open(args.input, encoding='UTF-8') as fh:
+        hfst_outs = collect_anals(emmorph, (line.strip() for line in fh))
+    emmorph.close()
+
+    parse_stem = emmorph._parse_stem
+    stemmer_process = emmorph._stemmer_process
+    loaded_conf = emmorph.loaded_conf
+    danals = [parse_stem(hfst_out) for hfst_out in hfst_outs]
+
+    parse_time = best_time(lambda: [parse_stem(hfst_out) for hfst_out in hfst_outs], args.repeat)
+    stem_time = best_time(lambda: [stemmer_process(danal, *loaded_conf) for danal in danals], args.repeat)
+
+    n = max(len(hfst_outs), 1)
+    print('analyses: {0}'.format(len(hfst_outs)), file=sys.stderr)
+    print('_parse_stem: {0:.2f} us/analysis'.format(parse_time / n * 1e6), file=sys.stderr)
+    print('_stemmer_process: {0:.2f} us/analysis ({1:.0f} analyses/s)'.format(stem_time / n * 1e6, n / stem_time),
+          file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
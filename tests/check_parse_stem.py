@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Differential test of the fast _parse_pairs against the character by character parser (_parse_stem_by_char)
+ over every analysis line of hfst-lookup for the input words: the lines are read directly from hfst-lookup
+ (without its time cutoff), so neither the timeout, nor max_allowed_anals, nor the stemmer can hide a difference
+"""
+
+import sys
+import argparse
+import subprocess
+
+from emmorphpy import EmMorphPy
+
+
+def without_time_cutoff(params):
+    """
+    The params of hfst-lookup without -t N and --time-cutoff=N
+    """
+    ret = []
+    skip_next = False
+    for param in params:
+        if skip_next:
+            skip_next = False
+        elif param in ('-t', '--time-cutoff'):
+            skip_next = True
+        elif not param.startswith('--time-cutoff=') and not (param.startswith('-t') and param[2:].isdigit()):
+            ret.append(param)
+    return ret
+
+
+def hfst_outs(emmorph, words):
+    """
+    All analyses (symbol pairs) of the words in the output of hfst-lookup
+    """
+    hfst_lookup, *params, fsa = emmorph._pool.cmd
+    cmd = [hfst_lookup, *without_time_cutoff(params), fsa]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, encoding='UTF-8')
+    out, _ = proc.communicate(''.join('{0}\n'.format(word) for word in words))
+    if proc.returncode != 0:
+        print('ERROR: {0} exited with {1}'.format(' '.join(cmd), proc.returncode), file=sys.stderr)
+        exit(1)
+    for line in out.split('\n'):
+        ret = line.split('\t')
+        if len(ret) == 3 and not ret[1].endswith('+?'):
+            yield ret[0], ret[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', '--input', default='tests/inputs/test_words.in', help='One word per line')
+    args = parser.parse_args()
+
+    with open(args.input, encoding='UTF-8') as fh:
+        words = sorted({line.strip() for line in fh if len(line.strip()) > 0})
+
+    emmorph = EmMorphPy(cache_size=0, timeout_ms=0, lazy_start=True)
+    parse_pairs = EmMorphPy._parse_pairs.__wrapped__  # Not memoized
+    no_of_anals = 0
+    no_of_diffs = 0
+    for word, hfst_out in hfst_outs(emmorph, words):
+        no_of_anals += 1
+        fast = list(parse_pairs(hfst_out))
+        reference = EmMorphPy._parse_stem_by_char(hfst_out)
+        if fast != reference:
+            no_of_diffs += 1
+            print(word, hfst_out, fast, reference, sep='\t')
+    emmorph.close()
+
+    print('{0} differences in {1} analyses of {2} words'.format(no_of_diffs, no_of_anals, len(words)), file=sys.stderr)
+    if no_of_diffs > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
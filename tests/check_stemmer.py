@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Differential test of the stemmer (EmMorphPy._stemmer_process() with the packed tag table) against the original
+ dict-based implementation kept below as the reference (compile_config(), bind_config() and stemmer_process()
+ are the versions before the tag table was packed): random morph sequences of the categories of the config
+ must give the same (lemma, tag) pairs (or none)
+"""
+
+import sys
+import random
+import argparse
+from io import StringIO
+from collections import defaultdict
+
+import jprops
+
+from emmorphpy import EmMorphPy
+from emmorphpy.emmorphpy import morph_flags
+
+LEXICALS = ('alma', '-', '', 'Wolf', 'a', 'GANG', 'ház', '.')
+EXTRA_CATEGORIES = ('/N', 'Nom', 'Ins', 'Poss.3Sg', 'unknown', 'Punct', '/Adj', '/V', 'Hyph:Dash')
+
+
+def compile_config(props_str):
+    props = jprops.load_properties(StringIO(props_str, newline=None))
+
+    item_sep = props.get('stemmer.item_sep', ';')
+    value_sep = props.get('stemmer.value_sep', '=')
+
+    tag_config = defaultdict(set)
+    for f, v in morph_flags.items():
+        for t in props.get('stemmer.{0}'.format(f), '').split(item_sep):
+            tag_config[t].add(v)
+
+    # Here we must have rsplit because "_PerfPtcp_Subj=tA/Adj=/Adj" -> "_PerfPtcp_Subj=tA/Adj": "/Adj"
+    tag_convert = dict(t.rsplit(value_sep, maxsplit=1)
+                       for t in props.get('stemmer.convert', '').split(item_sep)
+                       if len(t.rsplit(value_sep, maxsplit=1)) == 2)
+
+    tag_replace = dict(t.split(value_sep, maxsplit=1)
+                       for t in props.get('stemmer.replace', '').split(item_sep)
+                       if len(t.split(value_sep, maxsplit=1)) == 2)
+
+    # Precompute mappings into Look-up tables
+    STEM = 0
+    PREFIX = 1
+    COMP_MEMBER = 2
+    COMP_MUST_HAVE = 3
+
+    tag_config_is_stem = {}
+    tag_config_compound_member = {}
+    tag_convert_is_derivative = {}
+    tag_convert_config = {}
+    tag_replace_config = {}
+    tag_replace_config_is_prefix = {}
+    tag_replace_config_must_have_compound = {}
+
+    for category, flags in tag_config.items():
+        tag_config_is_stem[category] = STEM in flags
+        tag_config_compound_member[category] = COMP_MEMBER in flags
+
+        tagc = tag_convert.get(category) is not None
+        tag_convert_is_derivative[category] = tagc
+        flags_conv = tag_config.get(tagc, set())  # None -> set(), None can be hashed also!
+        tag_convert_config[category] = flags_conv
+
+        category_replaced = tag_replace.get(category, category)
+        flags_conv = tag_config.get(category_replaced, set())
+        tag_replace_config[category] = flags_conv
+        tag_replace_config_is_prefix[category] = PREFIX in flags_conv
+
+        tag_replace_config_must_have_compound[category] = int(COMP_MUST_HAVE in flags or
+                                                              COMP_MUST_HAVE in flags_conv)
+
+    for category, category_conv in tag_convert.items():
+        tag_convert_is_derivative[category] = True
+        flags_conv = tag_config.get(category_conv, set())  # None -> set(), None can be hashed also!
+        tag_convert_config[category] = flags_conv
+
+    for category, category_replaced in tag_replace.items():
+        flags_conv = tag_config.get(category_replaced, set())
+        tag_replace_config[category] = flags_conv
+        tag_replace_config_is_prefix[category] = PREFIX in flags_conv
+        tag_replace_config_must_have_compound[category] = int(COMP_MUST_HAVE in tag_config.get(category, set()) or
+                                                              COMP_MUST_HAVE in flags_conv)
+
+    # Not used
+    # unwanted_patterns = [re.compile(props.get('stemmer.exclude{0}'.format(n)))
+    #                      for n in range(100) if props.get('stemmer.exclude{0}'.format(n)) is not None]
+
+    copy2surface = set(props.get('stemmer.copy2surface', ''))
+
+    hfst_params = props.get('analyzer.params', '').split()
+    if len(hfst_params) > 0:
+        hfst_params = hfst_params[:-1]  # Cut the FSA
+
+    analyzer_conf = {'params': hfst_params, 'max_count': int(props.get('analyzer.max_count', 1)),
+                     'timeout_ms': int(props.get('analyzer.timeout_ms', 0))}
+
+    return tag_convert, tag_replace, tag_config_is_stem, tag_config_compound_member, tag_convert_is_derivative, \
+        tag_convert_config, tag_replace_config, tag_replace_config_is_prefix, \
+        tag_replace_config_must_have_compound, copy2surface, analyzer_conf
+
+
+def bind_config(tag_convert, tag_replace, tag_config_is_stem, tag_config_compound_member,
+                 tag_convert_is_derivative, tag_convert_config, tag_replace_config, tag_replace_config_is_prefix,
+                 tag_replace_config_must_have_compound, copy2surface, analyzer_conf):
+    # Bind methods for faster access
+    return tag_convert, tag_replace.get, tag_config_is_stem.get, tag_config_compound_member.get, \
+        tag_convert_is_derivative.get, tag_convert_config.get, tag_replace_config.get, \
+        tag_replace_config_is_prefix.get, tag_replace_config_must_have_compound.get, copy2surface, analyzer_conf
+
+
+def stemmer_process(input_str, tag_convert, tag_replace_get, tag_config_is_stem_get,
+                    tag_config_compound_member_get, tag_convert_is_derivative_get, tag_convert_config_get,
+                    tag_replace_config_get, tag_replace_config_is_prefix_get,
+                    tag_replace_config_must_have_compound_get, copy2surface):
+
+    STEM = 0
+    COMP_MEMBER = 2
+    COMP_BEFORE_HYPHEN = 4
+    STEM_IF_COMP = 5
+    INT_PUNCT = 6
+
+    derivative = False
+    must_have_compounds = 0   # how many morphemes with "compound must have" property
+    last_stem_code = -1       # last stem position
+    prev_last_stem_code = -1  # prev state of last_stem_code
+    hyphen_pos = -1           # position of a hyphen
+    look_for_compound = False
+
+    sure_compound = False
+    prev_compound = False
+
+    # Stem
+    morphs = []
+    len_morphs = 0
+    sz_stem = ''
+    stem_code = -1
+    compounds = 0
+
+    # bind methods for easier access
+    tag_convert_get = tag_convert.get
+
+    for lexical, category, surface in input_str:
+        is_stem = tag_config_is_stem_get(category, False)
+        compound_member = tag_config_compound_member_get(category, False)
+
+        # conversion
+        is_derivative = tag_convert_is_derivative_get(category, False)
+        flags_conv = tag_convert_config_get(category, set())
+
+        # tag replacement
+        category = tag_replace_get(category, category)
+        flags = tag_replace_config_get(category, set())  # Replace if found else keep
+
+        is_prefix = tag_replace_config_is_prefix_get(category, False)
+        must_have_compounds += tag_replace_config_must_have_compound_get(category, 0)
+
+        # copy spec cars from lexical
+        lex = lexical
+        if any(c in lex for c in copy2surface):  # else nothing to do :)
+            surf = surface
+            for i, l_i in enumerate(lex):
+                if l_i in copy2surface:
+                    surf = ''.join((surf[0:i], l_i, surf[i:]))
+
+            surface = surf
+
+        if compounds > 1 and hyphen_pos != len_morphs - 2:
+            # if it is in compound word: lowercase ("WolfGang"=>"Wolfgang")
+            lexical = lexical.lower()
+
+        # van-e 2 egymást követő compound member, (ha igen, tuti összetett)
+        sure_compound |= prev_compound and compound_member
+        prev_compound = compound_member
+
+        # ha volt már tő és ez képző => a konvertáltjait megkeressük, ha compound member, akkor beállítjuk
+        compound_member |= look_for_compound and COMP_MEMBER in flags_conv
+
+        morph = {'lexical': lexical,
+                 'surface': surface,
+                 'category': category,
+                 'is_prefix': is_prefix,
+                 'is_stem': is_stem,
+                 'is_derivative': is_derivative,
+                 'flags': flags,
+                 'flags_conv': flags_conv}
+        morphs.append(morph)
+        len_morphs = len(morphs)
+
+        if is_stem:
+            if lexical == '-':
+                hyphen_pos = len_morphs - 1
+
+            if stem_code == -1:
+                stem_code = len_morphs - 1  # save pos...
+
+            last_stem_code = len_morphs - 1
+            if prev_last_stem_code != -1 and lexical != '-':
+                convert = False
+                # Mutate list in loop!
+                for i in range(last_stem_code, prev_last_stem_code - 1, -1):
+                    m = morphs[i]
+                    convert |= m['is_stem']
+                    if convert and m['is_derivative']:
+                        m['category'] = tag_convert_get(m['category'], m['category'])
+                        fc = m['flags_conv']
+                        m['flags'] = fc
+                        m['is_stem'] |= STEM in fc
+
+            prev_last_stem_code = last_stem_code
+            # első tőalkotó után bekapcsoljuk, ha ez True, akkor keresünk olyan képzőt,
+            # ami compound membert csinál belőle
+            look_for_compound |= not derivative
+
+        # ha cmember => növelem
+        # ha tő ÉS jön egy compoundMember kepző => növelem
+        if compound_member:
+            compounds += 1
+            look_for_compound = False
+
+    # Itt a külső for ciklus vége
+    """
+    // === creating stem ===
+    // is it compound?
+    /*
+        -ha 2 tove van
+        -ha 1 tove + (conv->FN OR stem if compound)
+
+
+    teszt-esetek:
+        nagybefekteto
+        husdarabolo
+        husdarabologep
+        darabolo-evo
+        daraboloevo
+        darabologep
+        Lajos-
+        piros-
+     */
+    //TODO: es ha tobb kotojel van?
+    //"tájlátogató-felvilágosító"
+    """
+    if sure_compound:
+        # ez biztos összetett szó, mert 2 egymast követő compundmember van benne
+        # ha nincs benne FN, de képzett főnév igen, azt megmenti
+        # look for stem if compounds
+        for n in range(len_morphs):
+            m = morphs[n]  # Mutate list in loop!
+            if STEM_IF_COMP in m['flags']:
+                m['is_stem'] = True
+                m['category'] = tag_convert[m['category']]  # TODO: A None itt nincs kezelve
+                m['flags'] = m['flags_conv']
+                stem_code = n
+                last_stem_code = max(n, last_stem_code)
+
+    # kötőjeles akkor lehet összetett szó, ha a kötőjel előtt [compound before hyphen] all
+    # "aa[FN][NOM]-bb[FN][NOM]" vagy "aa[FN]-bb[FN]"
+    # pl "Árpad-ház"
+
+    # ha a kotojel elotti ures (pl. ('', 'Nom', '') es az azt megelozo toalkoto =>
+    # ha a kotojel elott rag van, akkor ez nem osszetett szo
+    # TODO: Simplify bool expression...
+    compound = compounds > 1 and hyphen_pos == -1 or must_have_compounds > 0
+    if hyphen_pos > 0 and compound:
+        m = morphs[hyphen_pos - 1]
+        if COMP_BEFORE_HYPHEN not in m['flags'] or (hyphen_pos > 1 and len(m['lexical']) == 0 and
+                                                    len(m['surface']) == 0 and
+                                                    not morphs[hyphen_pos - 2]['is_stem']):
+            compound = False
+
+    internal_punct = False
+    # most megmentjuk attol, hogy a PUNCT, PER vegu szavak to tipusa PUNCT legyen
+    for n in range(len_morphs-1, 0, -1):
+        m = morphs[n]  # Mutate list in loop!
+        if INT_PUNCT not in m['flags']:
+            break
+        internal_punct = True
+        m['is_stem'] = False
+
+    while last_stem_code > 0 and not morphs[last_stem_code]['is_stem']:
+        last_stem_code -= 1
+
+    if compound and not sure_compound:  # összetett szavaknál a stemIfCompoundokat átalakítja
+        for n in range(len_morphs):
+            m = morphs[n]  # Mutate list in loop!
+            if STEM_IF_COMP in m['flags']:
+                m['is_stem'] = True
+                m['category'] = tag_convert[m['category']]  # TODO: A None itt nincs kezelve
+                m['flags'] = m['flags_conv']
+                if n >= last_stem_code:
+                    last_stem_code = n
+
+    # végén van egy kötőjel, ha előtte ragozoztt szó áll, nem lehet szoösszetétel
+    # pl. "magán- és közjavak"
+    # ha a kötőjel előtti üres és az azt megelőző tőalkotó => hadd éljen, nem megy bele az ikerszó ágba
+    # ez már ikerszó nem lehet
+    # TODO: Simplify bool expression...
+    internal_punct_and = True
+    if internal_punct and hyphen_pos > 0:
+        m = morphs[hyphen_pos - 1]
+        if COMP_BEFORE_HYPHEN in m['flags'] and not (hyphen_pos > 1 and len(m['lexical']) == 0
+                                                     and len(m['surface']) == 0
+                                                     and not morphs[hyphen_pos - 2]['is_stem']):
+            internal_punct_and = False
+
+    # beleégetjük hogy a szóközi kötőjel stem
+    for n in range(1, len_morphs-2):
+        m = morphs[n]  # Mutate list in loop!
+        m['is_stem'] |= morphs[n - 1]['is_stem'] and morphs[n + 1]['is_stem'] and \
+            (m['surface'] == '-' or m['lexical'] == '-')
+
+    if internal_punct_and and hyphen_pos != -1 and not compound:  # ikerszo (pl. egyet-egyet -> egy-egy)
+
+        half = False
+        half_pos = next((z for z in range(max(hyphen_pos - 1, 0), 0, -1) if morphs[z]['is_stem']), stem_code)
+
+        tmp1 = ''
+        tmp2 = ''
+        for n, m in enumerate(morphs):
+            if m['lexical'] == '-':
+                half = True
+                half_pos = last_stem_code
+
+            if m['is_stem']:
+                if n < half_pos and len(m['surface']) != 0:
+                    sz_stem += m['surface']
+                else:
+                    sz_stem += m['lexical']
+            else:
+                if not half:
+                    tmp1 += m['category'] + ' '
+                else:
+                    tmp2 += m['category'] + ' '
+
+        if tmp1 != tmp2:  # BAD input, stem is dropped
+            sz_stem += '<incorrect word>'
+
+    else:  # simple case
+        if len_morphs >= last_stem_code:
+            for n, m in enumerate(morphs[:last_stem_code+1]):
+                if m['is_stem']:
+                    if n < last_stem_code:
+                        sz_stem += m['surface']
+                    else:
+                        sz_stem += m['lexical']
+
+    if sz_stem.endswith('<incorrect word>'):
+        return ()
+    else:
+        tag = '[{0}]'.format(']['.join(m['category'] for n, m in enumerate(morphs)
+                             if n >= last_stem_code or m['is_prefix']))
+        return sz_stem, tag
+
+def random_danals(categories, lexicals, n, seed):
+    rnd = random.Random(seed)
+    for _ in range(n):
+        yield [(rnd.choice(lexicals), rnd.choice(categories), rnd.choice(lexicals[:5]))
+               for _ in range(rnd.randint(1, 7))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-p', '--props', default=EmMorphPy.__init__.__defaults__[0], help='The config (props file)')
+    parser.add_argument('-n', '--number', type=int, default=300000, help='The number of random morph sequences')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.props, encoding='UTF-8') as fh:
+        props_str = fh.read()
+    reference_conf = bind_config(*compile_config(props_str))[:-1]
+    conf = EmMorphPy._bind_config(*EmMorphPy._compile_config(props_str))[:-1]
+
+    tag_convert, tag_replace = reference_conf[0], reference_conf[1].__self__
+    copy2surface = reference_conf[-1]
+    categories = sorted(set(tag_convert) | set(tag_convert.values()) | set(tag_replace) |
+                        set(reference_conf[2].__self__) | set(EXTRA_CATEGORIES))
+    lexicals = LEXICALS + tuple('x{0}y'.format(c) for c in sorted(copy2surface))
+
+    no_of_stems = 0
+    no_of_diffs = 0
+    for n, danal in enumerate(random_danals(categories, lexicals, args.number, args.seed), start=1):
+        reference = stemmer_process(danal, *reference_conf)
+        result = EmMorphPy._stemmer_process(danal, *conf)
+        no_of_stems += len(reference) > 0
+        if result != reference:
+            no_of_diffs += 1
+            if no_of_diffs <= 20:
+                print(danal, result, reference, sep='\t')
+
+    print('{0} differences in {1} morph sequences ({2} with a stem)'.format(no_of_diffs, n, no_of_stems),
+          file=sys.stderr)
+    if no_of_diffs > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
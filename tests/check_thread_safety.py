@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Stress test of one EmMorphPy(thread_safe=True) instance called from many threads at the same time:
+ every result must equal the one computed by a separate instance sequentially (a small cache forces evictions)
+"""
+
+import sys
+import random
+import argparse
+import threading
+from time import perf_counter
+
+from emmorphpy import EmMorphPy
+
+
+def worker(emmorph, words, reference, rounds, seed, errors):
+    try:
+        check(emmorph, words, reference, rounds, seed, errors)
+    except Exception as e:
+        errors.append(('exception', '', repr(e), ''))
+
+
+def check(emmorph, words, reference, rounds, seed, errors):
+    rnd = random.Random(seed)
+    calls = (('stem', emmorph.stem), ('analyze', emmorph.analyze), ('dstem', emmorph.dstem))
+    for _ in range(rounds):
+        sample = rnd.sample(words, min(len(words), 50))
+        task, fun = rnd.choice(calls)
+        if rnd.random() < 0.5:
+            results = [fun(word) for word in sample]
+        else:
+            results = getattr(emmorph, task + '_many')(sample)
+        for word, result in zip(sample, results):
+            if result != reference[task][word]:
+                errors.append((task, word, result, reference[task][word]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', '--input', default='tests/inputs/test_words.in', help='One word per line')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=200, help='Calls per thread (default: 200)')
+    parser.add_argument('--max-count', dest='max_count', type=int, default=4,
+                        help='Maximal number of hfst-lookup processes (default: 4)')
+    parser.add_argument('--cache-policy', dest='cache_policy', choices=('lru', 'lfu'), default='lfu')
+    args = parser.parse_args()
+
+    with open(args.input, encoding='UTF-8') as fh:
+        words = sorted({line.strip() for line in fh if len(line.strip()) > 0})
+
+    sequential = EmMorphPy(cache_size=0)
+    reference = {'stem': dict(zip(words, sequential.stem_many(words))),
+                 'analyze': dict(zip(words, sequential.analyze_many(words))),
+                 'dstem': dict(zip(words, sequential.dstem_many(words)))}
+    sequential.close()
+
+    emmorph = EmMorphPy(thread_safe=True, cache_size=max(1, len(words) // 10), cache_policy=args.cache_policy,
+                        max_count=args.max_count)
+    sys.setswitchinterval(1e-6)  # Switch between the threads as often as possible to provoke the races
+    errors = []
+    threads = [threading.Thread(target=worker, args=(emmorph, words, reference, args.rounds, seed, errors))
+               for seed in range(args.threads)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    emmorph.close()
+
+    for task, word, result, expected in errors[:20]:
+        print(task, word, result, expected, sep='\t')
+    print('{0} wrong results in {1} calls of {2} threads ({3:.2f} s)'.format(len(errors), args.threads * args.rounds,
+                                                                             args.threads, elapsed), file=sys.stderr)
+    if len(errors) > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+The results of EmMorphPy(truncation='restart') and AsyncEmMorphPy(truncation='restart') must equal the default (drain)
+ ones, also for the over-ambiguous words in the middle of a pipelined batch (the words in flight are resent after the
+ restart), and first_stems(word, n) must return the pairs of the first n distinct lemmas of the full analysis
+"""
+
+import sys
+import asyncio
+import argparse
+from time import perf_counter
+
+from emmorphpy import EmMorphPy, AsyncEmMorphPy
+
+OVER_AMBIGUOUS = 'D-dúr-H-dúr-C-dúr-G-dúr-Esz-dúr-G-dúr-D-dúr'
+
+
+def timed_dstem_many(emmorph, words):
+    start = perf_counter()
+    return emmorph.dstem_many(words), perf_counter() - start
+
+
+async def async_dstem_many(words):
+    async with AsyncEmMorphPy(cache_size=0, truncation='restart') as emmorph:
+        return await emmorph.dstem_many(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-i', '--input', default='tests/inputs/test_words.in', help='One word per line')
+    parser.add_argument('--max-lemmas', dest='max_lemmas', type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.input, encoding='UTF-8') as fh:
+        words = [line.strip() for line in fh if len(line.strip()) > 0]
+    middle = len(words) // 2
+    words = words[:middle] + [OVER_AMBIGUOUS] + words[middle:]
+
+    errors = []
+    drain = EmMorphPy(cache_size=0)
+    restart = EmMorphPy(cache_size=0, truncation='restart')
+    expected, drain_time = timed_dstem_many(drain, words)
+    results, restart_time = timed_dstem_many(restart, words)
+    errors.extend(('dstem_many', word, result, reference)
+                  for word, result, reference in zip(words, results, expected) if result != reference)
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(async_dstem_many(words))
+    finally:
+        loop.close()
+    errors.extend(('async dstem_many', word, result, reference)
+                  for word, result, reference in zip(words, results, expected) if result != reference)
+
+    for word in sorted(set(words)):
+        reference = drain.stem(word, out_mode=list)
+        lemmas = []
+        for pair in reference:
+            if pair not in lemmas:
+                lemmas.append(pair)
+        reference = sorted(set(lemmas[:args.max_lemmas]))
+        result = restart.first_stems(word, args.max_lemmas)
+        if result != reference:
+            errors.append(('stem', word, result, reference))
+
+    print('drain: {0:.2f} s, {1} truncations, {2} restarts'.format(drain_time, drain.no_of_truncations,
+                                                                  drain.stats()['restarts']), file=sys.stderr)
+    print('restart: {0:.2f} s, {1} truncations, {2} restarts'.format(restart_time, restart.no_of_truncations,
+                                                                    restart.stats()['restarts']), file=sys.stderr)
+    drain.close()
+    restart.close()
+
+    for task, word, result, expected in errors[:20]:
+        print(task, word, result, expected, sep='\t')
+    print('{0} wrong results of {1} words'.format(len(errors), len(words)), file=sys.stderr)
+    if len(errors) > 0:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
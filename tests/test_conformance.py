@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+Conformance of the in-process lookup (OptimizedLookup, EmMorphPy(backend='python')) to hfst-lookup:
+ the same analyses in the same order for ambiguous, unambiguous and unknown words, and for all words of
+ tests/inputs/test_words.in
+Skipped if NumPy (pip install emmorphpy[python-backend]), hfst-lookup or the transducer is missing
+ (EMMORPHPY_TEST_FSA can point to an other transducer than the one of the package)
+"""
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from emmorphpy import EmMorphPy  # noqa: E402
+from emmorphpy.hfstol import OptimizedLookup  # noqa: E402
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.join(TESTS_DIR, os.pardir, 'emmorphpy')
+PROPS = os.path.join(PACKAGE_DIR, 'hfst-wrapper.props')
+FSA = os.environ.get('EMMORPHPY_TEST_FSA', os.path.join(PACKAGE_DIR, 'hu.hfstol'))
+
+WORDS = ('almával', 'működik', 'a', 'az', 'egy', 'vár', 'ég', 'program', 'körtével', 'jóbarát', 'árvíztűrőtükörfúrógép',
+         'Budapesten', 'hasznos', 'legeslegnagyobb', '1848-ban', '+', '.', '"', 'xqzxqz', 'qwfpgjluy', 'Ázsiával')
+TEST_WORDS = os.path.join(TESTS_DIR, 'inputs', 'test_words.in')
+
+
+def hfst_lookup_anals(words):
+    """
+    The analyses of the words by hfst-lookup with the params of the props file (as in EmMorphPy._hfst_anals())
+    """
+    params = EmMorphPy._load_config(PROPS)[-1]['params']
+    out = subprocess.run(['hfst-lookup', *params, FSA], input=''.join('{0}\n'.format(word) for word in words),
+                         stdout=subprocess.PIPE, encoding='UTF-8', check=True).stdout
+    anals = {}
+    for word, block in zip(words, out.split('\n\n')):
+        fields = [line.split('\t') for line in block.split('\n') if len(line) > 0]
+        anals[word] = [ret[1] for ret in fields if len(ret) == 3 and not ret[1].endswith('+?')]
+    return anals
+
+
+@pytest.fixture(scope='module')
+def reference():
+    if shutil.which('hfst-lookup') is None:
+        pytest.skip('hfst-lookup is not installed')
+    if not os.path.exists(FSA):
+        pytest.skip('The transducer is missing: {0}'.format(FSA))
+    return hfst_lookup_anals(WORDS)
+
+
+@pytest.fixture(scope='module')
+def lookup(reference):
+    return OptimizedLookup(FSA)
+
+
+@pytest.fixture(scope='module')
+def test_words_reference(reference):
+    with open(TEST_WORDS, encoding='UTF-8') as fh:
+        words = sorted({line.strip() for line in fh if len(line.strip()) > 0})
+    return hfst_lookup_anals(words)
+
+
+@pytest.mark.parametrize('word', WORDS)
+def test_lookup(word, reference, lookup):
+    anals, timed_out = lookup.lookup(word)
+    assert not timed_out
+    assert anals == reference[word]
+
+
+def test_test_words(test_words_reference, lookup):
+    differences = []
+    for word, expected in test_words_reference.items():
+        anals, timed_out = lookup.lookup(word)
+        if timed_out or anals != expected:
+            differences.append((word, anals, expected))
+    assert differences[:10] == [], '{0} different words of {1}'.format(len(differences), len(test_words_reference))
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8, vim: expandtab:ts=4 -*-
+
+"""
+The warm-up from a word list: the cached words do not stop it, and AsyncEmMorphPy warms up through its own
+ AsyncHfstLookup (no processes of the HfstLookupPool are started)
+Skipped if hfst-lookup or the transducer is missing (EMMORPHPY_TEST_FSA can point to an other transducer)
+"""
+
+import os
+import shutil
+import asyncio
+
+import pytest
+
+from emmorphpy import EmMorphPy, AsyncEmMorphPy
+from emmorphpy.hfstlookup import HfstLookupPool
+
+FSA = os.environ.get('EMMORPHPY_TEST_FSA', os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                                                        'emmorphpy', 'hu.hfstol'))
+WORDS = ('a', 'program', 'működik', 'almával', '+')
+
+
+@pytest.fixture(scope='module')
+def word_list(tmp_path_factory):
+    if shutil.which('hfst-lookup') is None:
+        pytest.skip('hfst-lookup is not installed')
+    if not os.path.exists(FSA):
+        pytest.skip('The transducer is missing: {0}'.format(FSA))
+    path = tmp_path_factory.mktemp('warm_up') / 'freq_list.txt'
+    path.write_text(''.join('{0}\n'.format(word) for word in WORDS), encoding='UTF-8')
+    return str(path)
+
+
+def test_cached_batch(word_list, monkeypatch):
+    monkeypatch.setattr(EmMorphPy, 'warm_up_batch', 2)
+    emmorph = EmMorphPy(fsa=FSA, lazy_start=True)
+    emmorph.stem_many(WORDS[:2])  # The first batch is already cached
+    emmorph._start_warm_up(word_list, len(WORDS))
+    assert emmorph.warm_up_done(timeout=10)
+    emmorph.stem(WORDS[0])  # Takes the results
+    emmorph.close()
+    assert all(word in emmorph.cache for word in WORDS)
+
+
+def test_async(word_list, monkeypatch):
+    expected = EmMorphPy(fsa=FSA, lazy_start=True).stem_many(WORDS)
+
+    def acquire(self, *args, **kwargs):
+        raise AssertionError('A process of the HfstLookupPool is used')
+
+    monkeypatch.setattr(HfstLookupPool, 'acquire', acquire)
+
+    async def warm_up():
+        emmorph = AsyncEmMorphPy(fsa=FSA, warm_up=word_list)
+        assert await emmorph.warm_up_done(timeout=10)
+        cached = all(word in emmorph.cache for word in WORDS)
+        results = await emmorph.stem_many(WORDS)
+        await emmorph.close()
+        return cached, results
+
+    loop = asyncio.new_event_loop()
+    try:
+        cached, results = loop.run_until_complete(warm_up())
+    finally:
+        loop.close()
+    assert cached
+    assert results == expected